@@ -1,8 +1,19 @@
 #!/usr/bin/env python
 
+import argparse
+import fnmatch
+import io
+import json
 import os
+import re
 import sys
+import sqlite3
+import struct
 import subprocess
+import zipfile
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
 
 # This script indexes the java classes and java jars found under a directory.
 # It lists out every single class, file path, and jar file (if any).
@@ -13,24 +24,53 @@ import subprocess
 #
 #	index_java_classes  YOUR_DIR  > classes.txt
 #	index_java_classes  YOUR_DIR  | sort | uniq > classes.txt
+#	index_java_classes  --use-jar YOUR_DIR  # list jars with the jdk jar tool
+#	index_java_classes  --jobs 16 YOUR_DIR  # scan with 16 threads
+#	index_java_classes  --jobs 4 --processes 8 YOUR_DIR  # parse on 8 processes
+#	index_java_classes  --db classes.db YOUR_DIR  # only rescan changed files
+#	index_java_classes  --format jsonl YOUR_DIR  # or tsv
+#	index_java_classes  --prune node_modules --prune 'build/tmp' YOUR_DIR
+#	index_java_classes  --ignore-file .indexignore --follow-links YOUR_DIR
+#
+# As a library:
+#
+#	for data in iter_classes(['YOUR_DIR']):
+#		print(data['fqcn'], data['jar'])
+#
+# Queries against an index built with --db:
+#
+#	index_java_classes  which PXLDecoder --db classes.db  # where is it?
+#	index_java_classes  prefix PXL --db classes.db  # names starting with PXL
+#	index_java_classes  dupes --db classes.db  # classes found more than once
+#	index_java_classes  conflicts --db classes.db  # same class, other bytes?
+#	index_java_classes  rdeps com.acme.Util --db classes.db  # who uses it?
+#	index_java_classes  missing --db classes.db  # referenced, but not found
 #
 # Example output (tab-delimited):
 #
-# 	class: PXLDecoder		file: pxl-2000-decoder/PXLDecoder.class		jar: 
-# 	class: PXLDecoder		file: PXLDecoder.class		jar: pxl-2000-decoder/PXLDecoder.jar
-# 	class: PXLDecoderGUI		file: pxl-2000-decoder/PXLDecoderGUI.class		jar: 
-# 	class: PXLDecoderGUI		file: PXLDecoderGUI.class		jar: pxl-2000-decoder/PXLDecoder.jar
-# 	class: WaveFile		file: pxl-2000-decoder/WaveFile.class		jar: 
-# 	class: WaveFile		file: WaveFile.class		jar: pxl-2000-decoder/PXLDecoder.jar
+# 	class: PXLDecoder		file: pxl-2000-decoder/PXLDecoder.class		jar: 		fqcn: PXLDecoder
+# 	class: PXLDecoder		file: PXLDecoder.class		jar: pxl-2000-decoder/PXLDecoder.jar		fqcn: PXLDecoder
+# 	class: PXLDecoderGUI		file: pxl-2000-decoder/PXLDecoderGUI.class		jar: 		fqcn: PXLDecoderGUI
+# 	class: PXLDecoderGUI		file: PXLDecoderGUI.class		jar: pxl-2000-decoder/PXLDecoder.jar		fqcn: PXLDecoderGUI
+# 	class: WaveFile		file: pxl-2000-decoder/WaveFile.class		jar: 		fqcn: WaveFile
+# 	class: WaveFile		file: WaveFile.class		jar: pxl-2000-decoder/PXLDecoder.jar		fqcn: WaveFile
+#
+# fqcn is the fully qualified class name, read from the class file.
+# The index also keeps the classes each class references, from the
+# constant pool, for the rdeps and missing queries.
 #
 # Requirements:
 #
-#	Python 2.7+
-#	jar (command line tool included in jdk) 
+#	Python 3
+#	jar (command line tool included in jdk), only for --use-jar
 
 # logger 
 def log(s):
-	print s
+	print(s)
+
+# errors go to stderr, so they don't mix with the class listing
+def error(s):
+	sys.stderr.write(str(s) + '\n')
 
 # strip out class name from file
 # todo: parse file, jar
@@ -39,6 +79,93 @@ def get_classname(filename):
 	classname =  classname.replace('.class', '')
 	return classname
 
+# constant pool entry sizes after the tag byte.  utf8 (1) has a 2 byte
+# length instead.  long (5) and double (6) take two slots.
+cp_sizes = { 3: 4, 4: 4, 5: 8, 6: 8, 7: 2, 8: 2, 9: 4, 10: 4, 11: 4, 12: 4,
+				15: 3, 16: 2, 17: 4, 18: 4, 19: 2, 20: 2 }
+
+# read the fully qualified class name (this_class) of a class file,
+# and the classes it references (CONSTANT_Class entries, see ref_name).
+# f is an open binary file.  only the header and constant pool are
+# read, in chunks.  returns ('', []) if f is not a class file.
+def read_class_names(f):
+
+	buf = bytearray()
+	def need(n):
+		while len(buf) < n:
+			chunk = f.read(max(4096, len(buf)))
+			if not chunk:
+				raise ValueError('truncated class file')
+			buf.extend(chunk)
+
+	def utf8(slot):
+		start = offsets[slot]
+		length = (buf[start] << 8) | buf[start+1]
+		return buf[start+2:start+2+length].decode('utf-8', 'replace')
+
+	try:
+		need(10)
+		(magic, count) = struct.unpack_from('>I4xH', buf, 0)
+		if magic != 0xCAFEBABE:
+			return ('', [])
+
+		# utf8 entries: start of the 2 byte length.  class entries:
+		# slot of the name.
+		offsets = [0] * count
+		classes = [] # slots of the class entries
+		pos = 10
+		slot = 1
+		while slot < count:
+			if pos + 3 > len(buf):
+				need(pos + 3)
+			tag = buf[pos]
+			if tag == 1:
+				offsets[slot] = pos + 1
+				pos += 3 + ((buf[pos+1] << 8) | buf[pos+2])
+			elif tag == 7:
+				offsets[slot] = (buf[pos+1] << 8) | buf[pos+2]
+				classes.append(slot)
+				pos += 3
+			else:
+				pos += 1 + cp_sizes[tag]
+				if tag == 5 or tag == 6:
+					slot += 1
+			slot += 1
+
+		# access_flags, this_class
+		need(pos + 4)
+		this_class = (buf[pos+2] << 8) | buf[pos+3]
+		fqcn = utf8(offsets[this_class]).replace('/', '.')
+
+		refs = []
+		found = set([fqcn, ''])
+		for slot in classes:
+			if slot != this_class:
+				ref = ref_name(utf8(offsets[slot]))
+				if not ref in found:
+					found.add(ref)
+					refs.append(ref)
+
+		return (fqcn, refs)
+
+	except (ValueError, KeyError, IndexError, struct.error):
+		return ('', [])
+
+# the fully qualified class name of a class file, '' if f is not one
+def read_fqcn(f):
+	return read_class_names(f)[0]
+
+# dotted class name of a CONSTANT_Class entry.  arrays count as their
+# element class, inner classes as their outer class (inner classes are
+# not indexed).  '' for arrays of primitives.
+def ref_name(name):
+	if name.startswith('['):
+		name = name.lstrip('[')
+		if not (name.startswith('L') and name.endswith(';')):
+			return ''
+		name = name[1:-1]
+	return name.split('$')[0].replace('/', '.')
+
 # execute command line call
 # accepts string or array
 def cmd(command):
@@ -55,72 +182,828 @@ def cmd(command):
 		return iter(p.stdout.readline, b'')
 
 	except Exception as e:
-		log("error: could not execute " + str(cmd))
-		log(e)
+		error("error: could not execute " + str(command))
+		error(e)
 
 	return []
 
-# list contents of jar
+# errors reading a zip entry: unreadable or corrupt, unsupported
+# compression (NotImplementedError) or encrypted (RuntimeError)
+zip_errors = (IOError, zipfile.BadZipfile, zlib.error, NotImplementedError, RuntimeError)
+
+# archives to index.  war/ear and fat jars can hold more archives.
+archive_types = ('.jar', '.war', '.ear')
+
+# list contents of jar with the jdk jar tool (starts a jvm per jar).
+# returns (jar, name) pairs.  nested archives are not listed.
 def ls_jar(jar):
 	filelist  = cmd(["jar", "tf", jar])
-	return filelist
+	return ((jar, line.decode('utf-8', 'replace')) for line in filelist)
+
+# walk an open zip, and every archive nested in it.  yields (jar, z,
+# info) for each entry, where jar is the nesting path of the archive
+# holding the entry (like outer.war!/WEB-INF/lib/inner.jar) and z is
+# that archive, still open.  nested archives are read in memory, never
+# extracted.  stored entries (as in spring boot fat jars) are read
+# through a seekable view of the entry.
+def walk_zip(z, jar):
+	for info in z.infolist():
+		yield (jar, z, info)
+
+		if info.filename.endswith(archive_types):
+			nested = jar + '!/' + info.filename
+			try:
+				if info.compress_type == zipfile.ZIP_STORED:
+					f = z.open(info)
+				else:
+					f = io.BytesIO(z.read(info))
+				with f, zipfile.ZipFile(f) as z2:
+					for item in walk_zip(z2, nested):
+						yield item
+			except zip_errors as e:
+				error("error: could not read " + nested)
+				error(e)
+
+# fully qualified name of a class file in a zip, or ''
+def zip_class_names(z, info):
+	try:
+		with z.open(info) as f:
+			return read_class_names(f)
+	except zip_errors:
+		return ('', []) # unreadable, unsupported compression or encrypted
+
+# record fields, in output order.  size and crc (crc32) are the
+# uncompressed size and checksum of the class file, from the zip
+# directory.  loose .class files have no crc (None), see file_crc().
+# records also carry refs, the fully qualified names of the classes
+# they reference (not part of any output format).
+record_fields = ['class', 'file', 'jar', 'fqcn', 'size', 'crc']
+
+# fields of the text format
+text_fields = ['class', 'file', 'jar', 'fqcn']
 
 # printer
 def print_class_info(data):
-	s = 'class: '+data['class']+"\t\t"+'file: '+data['file']+"\t\t"+'jar: '+data['jar']
-	log(s)
+	log(format_text(data))
+
+# one record per output format, as a line without the newline
+def format_text(data):
+	return '\t\t'.join(k + ': ' + data[k] for k in text_fields)
+
+def format_tsv(data):
+	values = ['' if data[k] == None else str(data[k]) for k in record_fields]
+	return '\t'.join(v.replace('\t', ' ').replace('\n', ' ') for v in values)
+
+def format_jsonl(data):
+	return json.dumps(dict((k, data[k]) for k in record_fields))
+
+# output formats: (line formatter, header line or None)
+formats = {
+	'text': (format_text, None),
+	'tsv': (format_tsv, '\t'.join(record_fields)),
+	'jsonl': (format_jsonl, None),
+}
+
+# write records to out in one of formats, a block of lines at a time
+def write_records(records, format='text', out=None, block=1000):
+
+	out = out or sys.stdout
+	(line, header) = formats[format]
+	if header != None:
+		out.write(header + '\n')
+
+	lines = []
+	for data in records:
+		lines.append(line(data))
+		if len(lines) >= block:
+			lines.append('')
+			out.write('\n'.join(lines))
+			lines = []
+
+	if len(lines) > 0:
+		lines.append('')
+		out.write('\n'.join(lines))
+	out.flush()
+
+# refs of a loose .class file, [] if it can't be read
+def read_class_refs(fullpath):
+	try:
+		with open(fullpath, 'rb') as f:
+			return read_class_names(f)[1]
+	except IOError:
+		return []
+
+# add refs (of inner classes) to the refs of a record, without
+# duplicates or references to the record's own class
+def merge_refs(data, refs):
+	found = set(data['refs'])
+	found.add(data['fqcn'])
+	for ref in refs:
+		if not ref in found:
+			found.add(ref)
+			data['refs'].append(ref)
+
+# records for a loose .class file of size bytes.  inner classes are not
+# listed, but the refs of the inner class files in inner (like
+# Outer$1.class) count as refs of the outer class.
+def read_class(fullpath, size=None, inner=()):
+
+	if '$' in fullpath:
+		return [] # ignore inner
+
+	classname = get_classname(fullpath)
+	try:
+		with open(fullpath, 'rb') as f:
+			(fqcn, refs) = read_class_names(f)
+	except IOError:
+		(fqcn, refs) = ('', [])
+
+	data = { 
+				'file':fullpath,
+				'jar':'', # no jar
+				'class':classname,
+				'fqcn':fqcn,
+				'size':size,
+				'crc':None, # only hashed when needed
+				'refs':refs,
+			}
+
+	for path in inner:
+		merge_refs(data, read_class_refs(path))
+
+	return [data]
+
+# records of loose .class files, a record list per (fullpath, size,
+# inner).  one task of a process pool, see read_files().
+def read_classes(files):
+	return [read_class(fullpath, size, inner) for (fullpath, size, inner) in files]
+
+# outer class file of an inner class file (a/Outer$1.class ->
+# a/Outer.class), or None if name is not an inner class
+def outer_class(name):
+	(dirname, filename) = os.path.split(name)
+	if not '$' in filename:
+		return None
+	return os.path.join(dirname, filename.split('$')[0] + '.class')
+
+# records for the classes in a jar (or war, ear), and in any archives
+# nested in it.  the refs of inner classes count as refs of their outer
+# class.
+# use_jar: list jars with `jar tf` instead of zipfile (no fqcn, no
+# nested archives)
+# returns None if the jar can't be read.
+def read_jar(fullpath, use_jar=False):
+
+	records = []
+
+	def add(jar, jarcontent, names, size=None, crc=None):
+
+		if '$' in jarcontent:
+			return # ignore inner classes
+
+		jarcontent = jarcontent.strip()
+		if jarcontent.endswith('.class'):
+			classname = get_classname(jarcontent)
+			data = { 
+						'file': jarcontent,
+						'jar': jar,
+						'class': classname,
+						'fqcn': names[0],
+						'size': size,
+						'crc': crc,
+						'refs': names[1],
+					}	
+
+			records.append(data)
+
+	if use_jar:
+		for (jar, jarcontent) in ls_jar(fullpath):
+			add(jar, jarcontent, ('', []))
+		return records
+
+	inner = {} # (jar, outer class file) -> refs of its inner classes
+	try:
+		with zipfile.ZipFile(fullpath) as z:
+			for (jar, z2, info) in walk_zip(z, fullpath):
+				if not info.filename.endswith('.class'):
+					continue
+				outer = outer_class(info.filename)
+				if outer != None:
+					inner.setdefault((jar, outer), []).extend(zip_class_names(z2, info)[1])
+				elif not '$' in info.filename:
+					add(jar, info.filename, zip_class_names(z2, info), info.file_size, info.CRC)
+	except (IOError, zipfile.BadZipfile) as e:
+		error("error: could not read " + fullpath)
+		error(e)
+		return None
+
+	for data in records:
+		if (data['jar'], data['file']) in inner:
+			merge_refs(data, inner[(data['jar'], data['file'])])
+
+	return records
+
+# persistent class index (sqlite).  keeps the records of every .class
+# and .jar file along with its size and mtime, so a rerun only has to
+# read new or changed files.  paths are absolute, so the same tree
+# indexed from another cwd or under another spelling is one copy.
+# the refs table holds the reference graph,
+# an edge from each class record to every class it references.
+class class_index:
+
+	# bump when the tables change.  an index with another version is
+	# rebuilt from scratch.
+	version = 6
+
+	# record fields, stored as columns of the classes table
+	fields = record_fields
+
+	def __init__(self, filename):
+		self.db = sqlite3.connect(filename)
+
+		if self.db.execute('pragma user_version').fetchone()[0] != self.version:
+			self.db.executescript("""
+				drop table if exists files;
+				drop table if exists classes;
+				drop table if exists refs;
+				pragma user_version = %d;
+			""" % self.version)
+
+		self.db.executescript("""
+			create table if not exists files (
+				path text primary key,
+				size integer,
+				mtime integer
+			);
+			create table if not exists classes (
+				path text,   -- .class or .jar file the record came from
+				seq integer, -- order within path
+				key text,    -- fqcn, or class when the package is unknown
+				class text,
+				file text,
+				jar text,
+				fqcn text,
+				size integer,
+				crc integer
+			);
+			create index if not exists classes_path on classes (path, seq);
+			create index if not exists classes_class on classes (class);
+			create index if not exists classes_fqcn on classes (fqcn);
+			create index if not exists classes_key on classes (key);
+			create table if not exists refs (
+				path text,   -- with seq, the referencing classes row
+				seq integer,
+				ref text     -- fully qualified name of the referenced class
+			);
+			create index if not exists refs_path on refs (path);
+			create index if not exists refs_ref on refs (ref);
+		""")
+
+		self.columns = ', '.join(self.fields)
+
+		# path -> (size, mtime), to check files without a query each
+		self.files = {}
+		for (path, size, mtime) in self.db.execute('select path, size, mtime from files'):
+			self.files[path] = (size, mtime)
+
+	# is the stored copy of path up to date?
+	def fresh(self, path, size, mtime):
+		return self.files.get(path) == (size, mtime)
+
+	# stored records of path, with their refs
+	def records(self, path):
+		records = self.query('where path = ? order by seq', (path,))
+		for data in records:
+			data['refs'] = []
+		for (seq, ref) in self.db.execute('select seq, ref from refs where path = ? order by rowid', (path,)):
+			records[seq]['refs'].append(ref)
+		return records
+
+	# replace the stored records of path
+	def update(self, path, size, mtime, records):
+		self.db.execute('delete from classes where path = ?', (path,))
+		self.db.execute('delete from refs where path = ?', (path,))
+		self.db.executemany('insert into classes (path, seq, key, ' + self.columns + ') values (?, ?, ?'
+			+ ', ?' * len(self.fields) + ')',
+			[[path, seq, d['fqcn'] or d['class']] + [d[k] for k in self.fields] for (seq, d) in enumerate(records)])
+		self.db.executemany('insert into refs (path, seq, ref) values (?, ?, ?)',
+			[(path, seq, ref) for (seq, d) in enumerate(records) for ref in d.get('refs', [])])
+		self.db.execute('insert or replace into files (path, size, mtime) values (?, ?, ?)',
+			(path, size, mtime))
+		self.files[path] = (size, mtime)
+
+	# forget the records of path
+	def drop(self, path):
+		self.db.execute('delete from classes where path = ?', (path,))
+		self.db.execute('delete from refs where path = ?', (path,))
+		self.db.execute('delete from files where path = ?', (path,))
+		self.files.pop(path, None)
 
-def analyze_java(startdir):
-	# scan folder
-	for dirname, dirnames, filenames in os.walk(startdir):
+	# drop files under startdirs (absolute) that were not seen in this
+	# scan
+	def prune(self, startdirs, seen):
+		gone = []
+		for path in self.files:
+			if path in seen:
+				continue
+			for startdir in startdirs:
+				if path.startswith(os.path.join(startdir, '')):
+					gone.append(path)
+					break
 
-		if '.git' in dirnames:
-			# don't go into any .git directories.
-			dirnames.remove('.git')
+		for path in gone:
+			self.drop(path)
 
-		for filename in filenames:
-			fullpath = os.path.join(dirname, filename)
+	# records of all classes named name (simple or fully qualified)
+	def which(self, name):
+		return self.query('where class = ? or fqcn = ? order by jar, file', (name, name))
 
-			if fullpath.endswith('.class'):
+	# records of all classes whose name (simple or fully qualified)
+	# starts with prefix
+	def prefix(self, prefix):
+		end = prefix + '\U0010ffff'
+		return self.query('where (class >= ? and class < ?) or (fqcn >= ? and fqcn < ?) order by class, jar, file',
+			(prefix, end, prefix, end))
 
-				if '$' in fullpath:
-					continue # ignore inner
+	# records of all classes found in more than one place.  classes are
+	# told apart by fully qualified name, when known (the key column).
+	def dupes(self):
+		return self.query("""where key in
+			(select key from classes group by key having count(*) > 1)
+			order by key, jar, file""")
 
-				classname = get_classname(fullpath)
-				data = { 
-							'file':fullpath,
-							'jar':'', # no jar
-							'class':classname,
-						}
+	# records of all classes that reference name (fully qualified, or a
+	# simple name matching any package)
+	def rdeps(self, name):
+		suffix = '.' + name
+		return self.query("""where (path, seq) in
+			(select path, seq from refs where ref = ? or substr(ref, -?) = ?)
+			order by fqcn, class, jar, file""", (name, len(suffix), suffix))
 
-				print_class_info(data)
+	# classes referenced but not found in the index, as (name, number of
+	# referencing records) sorted by name.  names starting with one of
+	# skip are left out.
+	def missing(self, skip=()):
+		rows = self.db.execute("""select ref, count(*) from refs
+			where ref not in (select fqcn from classes)
+			group by ref order by ref""")
+		return [(ref, n) for (ref, n) in rows if not ref.startswith(tuple(skip))]
 
-			elif fullpath.endswith('.jar'):
+	def query(self, where, params=()):
+		rows = self.db.execute('select ' + self.columns + ' from classes ' + where, params)
+		return [dict(zip(self.fields, row)) for row in rows]
 
-				jarcontents = ls_jar(fullpath)
-				for jarcontent in jarcontents:	
+	def close(self):
+		self.db.commit()
+		self.db.close()
 
-					if '$' in jarcontent:
-						continue # ignore inner classes
+# what to skip while walking, and whether to follow symlinked dirs.
+# prune globs are matched against file and dir names, or against the
+# path below the start dir when the glob has a /.
+class walk_rules:
 
-					jarcontent = jarcontent.strip()
-					if jarcontent.endswith('.class'):
-						classname = get_classname(jarcontent)
-						data = { 
-									'file': jarcontent,
-									'jar': fullpath,
-									'class': classname,
-								}	
+	def __init__(self, prune=['.git'], follow_links=False):
+		self.prune_globs = list(prune)
+		self.follow_links = follow_links
 
-						print_class_info(data)
+		names = [g for g in prune if not '/' in g]
+		paths = [g.strip('/') for g in prune if '/' in g]
+		self.names = re.compile('|'.join(fnmatch.translate(g) for g in names)) if names else None
+		self.paths = re.compile('|'.join(fnmatch.translate(g) for g in paths)) if paths else None
+
+	# skip name in dirname?  top is the start dir of the walk
+	def prune(self, dirname, name, top):
+		if self.names != None and self.names.match(name):
+			return True
+		if self.paths != None:
+			path = os.path.relpath(os.path.join(dirname, name), top).replace(os.sep, '/')
+			return self.paths.match(path) != None
+		return False
+
+# read prune globs from an ignore file, one per line.  blank lines and
+# lines starting with # are skipped.
+def read_ignore_file(filename):
+	globs = []
+	with open(filename) as f:
+		for line in f:
+			line = line.strip()
+			if line != '' and not line.startswith('#'):
+				globs.append(line)
+	return globs
+
+# list one directory.  returns (dirname, files, subdirs) in directory
+# order like os.walk, where files are (name, size, mtime) of the .class
+# and .jar files, and subdirs are scan_dir() arguments for each subdir.
+# entry types come from the directory listing, only .class and .jar
+# files are stat'ed.
+# rules: walk_rules, top: start dir of the walk.  when following
+# symlinks, ancestors holds the (device, inode) of every dir above, and
+# a symlink back to one of them is skipped.
+def scan_dir(dirname, rules=None, top=None, ancestors=()):
+
+	rules = rules or default_rules
+	files = []
+	subdirs = []
+	try:
+		entries = list(os.scandir(dirname))
+	except OSError:
+		entries = [] # unreadable, or not a directory
+
+	for entry in entries:
+		if rules.prune(dirname, entry.name, top or dirname):
+			continue
+
+		# one bad entry (say a dangling symlink) must not hide the rest
+		try:
+			if entry.is_dir():
+				if not rules.follow_links:
+					if not entry.is_symlink():
+						subdirs.append((entry.path, rules, top or dirname, ()))
+					continue
+
+				st = entry.stat()
+				key = (st.st_dev, st.st_ino)
+				if key in ancestors:
+					continue # symlink cycle
+				subdirs.append((entry.path, rules, top or dirname, ancestors + (key,)))
+
+			elif entry.name.endswith('.class') or entry.name.endswith(archive_types):
+				st = entry.stat()
+				files.append((entry.name, st.st_size, st.st_mtime_ns))
+		except OSError as e:
+			error("error: could not read " + entry.path)
+			error(e)
+
+	return (dirname, files, subdirs)
+
+# scan_dir() arguments for a start dir
+def scan_start(startdir, rules):
+	ancestors = ()
+	if rules.follow_links:
+		try:
+			st = os.stat(startdir)
+			ancestors = ((st.st_dev, st.st_ino),)
+		except OSError:
+			pass
+	return (startdir, rules, startdir, ancestors)
+
+default_rules = walk_rules()
+
+# start reading the .class and .jar files of a scanned directory on the
+# pool.  returns a list of jobs (path, size, mtime, result) in directory
+# order, where result is a record list, a future, a (future, n) pair for
+# the nth list of a read_classes() batch, or indexed when the index
+# already has the file.
+# procs: process pool to parse jars and class files on, or None to read
+# jars on pool and class files right here.  loose class files go to it
+# in batches of up to batch files.
+def read_files(pool, dirname, files, use_jar, index, procs=None, batch=256):
+
+	# inner class files of each outer class file, read along with it
+	inner = {}
+	for (filename, size, mtime) in files:
+		outer = outer_class(filename)
+		if outer != None and filename.endswith('.class'):
+			inner.setdefault(os.path.join(dirname, outer), []).append(
+				(os.path.join(dirname, filename), size, mtime))
+
+	# is path, and every inner class file of it, in the index?
+	def fresh(fullpath, size, mtime):
+		if not index.fresh(fullpath, size, mtime):
+			return False
+		return all(index.fresh(*f) for f in inner.get(fullpath, []))
+
+	jobs = []
+	loose = [] # jobs waiting for a batch
+	for (filename, size, mtime) in files:
+		fullpath = os.path.join(dirname, filename)
+		inner_paths = [f[0] for f in inner.get(fullpath, [])]
+
+		if index != None and fresh(fullpath, size, mtime):
+			jobs.append((fullpath, size, mtime, indexed))
+		elif fullpath.endswith('.class'):
+			if procs == None:
+				jobs.append((fullpath, size, mtime, read_class(fullpath, size, inner_paths)))
+			else:
+				loose.append((len(jobs), inner_paths))
+				jobs.append((fullpath, size, mtime, None)) # filled in below
+		elif fullpath.endswith(archive_types):
+			jobs.append((fullpath, size, mtime, (procs or pool).submit(read_jar, fullpath, use_jar)))
+
+	for start in range(0, len(loose), batch):
+		positions = loose[start:start+batch]
+		future = procs.submit(read_classes, [jobs[i][:2] + (inner_paths,) for (i, inner_paths) in positions])
+		for (n, (i, inner_paths)) in enumerate(positions):
+			jobs[i] = jobs[i][:3] + ((future, n),)
+
+	return jobs
+
+# job result of a file the index already has, see read_files()
+indexed = object()
+
+# the future a job is waiting for, or None
+def job_future(job):
+	result = job[3]
+	if isinstance(result, tuple):
+		return result[0]
+	if isinstance(result, Future):
+		return result
+	return None
+
+# finish a job from read_files().  returns its records, and keeps the
+# index up to date.  seen collects the paths of all jobs.  a file that
+# could not be read is dropped from the index, so it is read again next
+# time.
+def job_records(job, index, seen):
+
+	(fullpath, size, mtime, result) = job
+	seen.add(fullpath)
+
+	if result is indexed:
+		return index.records(fullpath)
+
+	if isinstance(result, tuple):
+		(future, n) = result
+		result = future.result()[n]
+	elif isinstance(result, Future):
+		result = result.result()
+
+	if result == None:
+		if index != None:
+			index.drop(fullpath)
+		return []
+
+	if index != None:
+		index.update(fullpath, size, mtime, result)
+
+	return result
+
+# yield records of a directory tree in os.walk order.  subdirectories
+# and jars are read ahead on the pool, results are consumed in order.
+def walk_ordered(pool, dir_future, use_jar, index, seen, procs=None):
+
+	(dirname, files, subdirs) = dir_future.result()
+
+	jobs = read_files(pool, dirname, files, use_jar, index, procs)
+	subdirs = [pool.submit(scan_dir, *args) for args in subdirs]
+
+	for job in jobs:
+		for data in job_records(job, index, seen):
+			yield data
+
+	for subdir in subdirs:
+		for data in walk_ordered(pool, subdir, use_jar, index, seen, procs):
+			yield data
+
+# yield records of directory trees as soon as they are read
+def walk_unordered(pool, startdirs, use_jar, index, seen, rules, procs=None):
+
+	pending = set(pool.submit(scan_dir, *scan_start(d, rules)) for d in startdirs)
+	jobs = {} # future -> jobs waiting for it, for jar and class reads
+
+	while len(pending) > 0:
+		(done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+		for future in done:
+			if future in jobs:
+				for job in jobs.pop(future):
+					for data in job_records(job, index, seen):
+						yield data
+				continue
+
+			(dirname, files, subdirs) = future.result()
+			for job in read_files(pool, dirname, files, use_jar, index, procs):
+				job_wait = job_future(job)
+				if job_wait != None:
+					jobs.setdefault(job_wait, []).append(job)
+					pending.add(job_wait)
+				else:
+					for data in job_records(job, index, seen):
+						yield data
+
+			for args in subdirs:
+				pending.add(pool.submit(scan_dir, *args))
+
+# index directory trees, yields a record (dict of record_fields, and
+# refs) for every class found.
+# use_jar: list jars with `jar tf` instead of zipfile
+# jobs: threads for scanning directories and reading jars
+# ordered: yield in os.walk order (else as soon as read)
+# index: class_index to reuse and update, or None.  deleted files are
+# dropped from the index once the walk is done.  the index keeps
+# absolute paths, records are still yielded under startdirs as given.
+# rules: walk_rules (prune globs, symlinks), default skips .git
+# processes: parse jars and class files on this many processes, 0 to
+# parse them on the threads
+def iter_classes(startdirs, use_jar=False, jobs=1, ordered=True, index=None, rules=None, processes=0):
+
+	rules = rules or default_rules
+	seen = set()
+
+	# walk absolute paths when indexing
+	roots = [os.path.abspath(d) if index != None else d for d in startdirs]
+	places = sorted(zip(roots, startdirs), key=lambda place: -len(place[0]))
+
+	with ThreadPoolExecutor(max_workers=jobs) as pool, \
+			(ProcessPoolExecutor(max_workers=processes) if processes > 0 else nullcontext()) as procs:
+		if ordered:
+			for (root, startdir) in zip(roots, startdirs):
+				dir_future = pool.submit(scan_dir, *scan_start(root, rules))
+				for data in walk_ordered(pool, dir_future, use_jar, index, seen, procs):
+					yield relocate(data, [(root, startdir)])
+		else:
+			for data in walk_unordered(pool, roots, use_jar, index, seen, rules, procs):
+				yield relocate(data, places)
+
+	if index != None:
+		index.prune(roots, seen)
+
+# a record with its path under root shown under startdir instead.
+# places are (root, startdir) pairs, longest root first.
+def relocate(data, places):
+	key = 'jar' if data['jar'] != '' else 'file'
+	path = data[key]
+	for (root, startdir) in places:
+		if root == startdir:
+			continue
+		if path.startswith(os.path.join(root, '')):
+			return dict(data, **{key: os.path.join(startdir, path[len(root):].lstrip(os.sep))})
+	return data
+
+# crc32 of a file, the same checksum zip directories keep.
+# None if the file can't be read.
+def file_crc(path):
+	crc = 0
+	try:
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(65536), b''):
+				crc = zlib.crc32(chunk, crc)
+	except IOError:
+		return None
+
+	return crc & 0xffffffff
+
+# group records by fully qualified name (simple name when unknown), and
+# tell apart the versions of every class found more than once.  copies
+# are compared by size and crc from the zip directory, nothing is
+# decompressed.  loose .class files are only hashed when another copy
+# has the same size.
+# yields (name, versions, unknown) sorted by name, where versions is a
+# list of record lists, one per distinct version, and unknown are the
+# copies that can't be compared: no size (jars listed with --use-jar),
+# or no crc when another copy has the same size.
+def find_duplicates(records):
+
+	groups = {}
+	for data in records:
+		groups.setdefault(data['fqcn'] or data['class'], []).append(data)
+
+	for name in sorted(groups):
+		copies = groups[name]
+		if len(copies) < 2:
+			continue
+
+		sizes = {}
+		for data in copies:
+			sizes[data['size']] = sizes.get(data['size'], 0) + 1
+
+		versions = {} # (size, crc) -> records
+		unknown = []
+		for data in copies:
+			if data['size'] == None:
+				unknown.append(data)
+				continue
+			if data['crc'] == None and sizes[data['size']] > 1:
+				if data['jar'] == '':
+					data = dict(data, crc=file_crc(data['file'])) # tie, hash it
+				if data['crc'] == None:
+					unknown.append(data)
+					continue
+			versions.setdefault((data['size'], data['crc']), []).append(data)
+
+		yield (name, list(versions.values()), unknown)
+
+# print duplicate classes from find_duplicates().  a class is unknown
+# when some copies can't be compared and the rest are identical.
+# returns the number of conflicts (classes with more than one version).
+def print_duplicates(duplicates):
+
+	conflicts = 0
+	for (name, versions, unknown) in duplicates:
+		copies = sum(len(v) for v in versions) + len(unknown)
+		if len(versions) > 1:
+			conflicts += 1
+			log('conflict: %s\t\tversions: %d\t\tcopies: %d' % (name, len(versions), copies))
+		elif len(unknown) > 0:
+			log('unknown: %s\t\tcopies: %d' % (name, copies))
+		else:
+			log('identical: %s\t\tcopies: %d' % (name, copies))
+
+		for (n, version) in enumerate(versions):
+			for data in version:
+				crc = '?' if data['crc'] == None else '%08x' % data['crc']
+				log('\tversion %d: size %s crc %s\t\tfile: %s\t\tjar: %s'
+					% (n+1, data['size'], crc, data['file'], data['jar']))
+		for data in unknown:
+			log('\tunknown: size %s crc ?\t\tfile: %s\t\tjar: %s'
+				% ('?' if data['size'] == None else data['size'], data['file'], data['jar']))
+
+	return conflicts
+
+# index directory trees, print every class found
+def analyze_java(startdirs, use_jar=False, jobs=1, ordered=True, index=None, format='text', rules=None, processes=0):
+	write_records(iter_classes(startdirs, use_jar, jobs, ordered, index, rules, processes), format)
 
 if __name__ == '__main__':
 
-	if len(sys.argv) < 2:
-		print( "usage: " + sys.argv[0] + ' dirname [dirname dirname ...]') 
-		exit(1)
+	# parse on a process per cpu.  a single cpu gains nothing from a
+	# process pool, only the overhead.
+	default_processes = os.cpu_count() or 1
+	if default_processes == 1:
+		default_processes = 0
+
+	# query subcommands, answered from an index built with --db
+	queries = ['which', 'prefix', 'dupes', 'conflicts', 'rdeps', 'missing']
+
+	# packages of the jdk, left out of missing unless --all
+	jdk_packages = ['java.', 'javax.', 'jdk.', 'sun.', 'com.sun.', 'org.w3c.dom.', 'org.xml.sax.']
+
+	if len(sys.argv) > 1 and sys.argv[1] in queries:
+		parser = argparse.ArgumentParser(
+			description='Query an index built with --db.')
+		parser.add_argument('query', choices=queries,
+			help='which NAME: where is class NAME.  prefix TEXT: classes starting with TEXT.  dupes: classes found more than once.  conflicts: duplicate classes, as identical copies or conflicting versions.  rdeps NAME: classes that reference NAME.  missing: classes referenced but not found.')
+		parser.add_argument('name', nargs='?', default='')
+		parser.add_argument('--db', metavar='FILE', required=True,
+			help='sqlite index to query')
+		parser.add_argument('--format', choices=sorted(formats), default='text',
+			help='output format (default: text)')
+		parser.add_argument('--all', action='store_true',
+			help='missing: also list jdk classes (' + ' '.join(p + '*' for p in jdk_packages) + ')')
+		args = parser.parse_args()
+
+		if not args.query in ['dupes', 'conflicts', 'missing'] and args.name == '':
+			parser.error(args.query + ' needs a class name')
+		if not os.path.exists(args.db):
+			parser.error('no index: ' + args.db)
+
+		index = class_index(args.db)
+		if args.query == 'conflicts':
+			conflicts = print_duplicates(find_duplicates(index.dupes()))
+			index.close()
+			exit(0 if conflicts > 0 else 1)
+		elif args.query == 'missing':
+			missing = index.missing([] if args.all else jdk_packages)
+			index.close()
+			for (name, count) in missing:
+				log('missing: %s\t\treferenced by: %d' % (name, count))
+			exit(0 if len(missing) > 0 else 1)
+		elif args.query == 'dupes':
+			records = index.dupes()
+		else:
+			records = getattr(index, args.query)(args.name)
+		index.close()
+
+		write_records(records, args.format)
+		exit(0 if len(records) > 0 else 1)
+
+	parser = argparse.ArgumentParser(
+		description='Index the java classes and jars found under directories.',
+		epilog='queries: ' + sys.argv[0] + ' {which NAME,prefix TEXT,dupes,conflicts,rdeps NAME,missing} --db FILE')
+	parser.add_argument('dirnames', nargs='+', metavar='dirname')
+	parser.add_argument('--use-jar', action='store_true',
+		help='list jars with the jdk jar tool instead of reading them directly')
+	parser.add_argument('-j', '--jobs', type=int, default=1,
+		help='threads for scanning directories and reading jars (default: 1)')
+	parser.add_argument('-p', '--processes', type=int, default=default_processes,
+		help='parse jars and class files on this many processes, 0 to parse on the --jobs threads (default: %d)' % default_processes)
+	parser.add_argument('--unordered', action='store_true',
+		help='print classes as soon as they are read, instead of in directory order')
+	parser.add_argument('--db', metavar='FILE',
+		help='keep a persistent index in sqlite FILE, only read new or changed files')
+	parser.add_argument('--format', choices=sorted(formats), default='text',
+		help='output format: text (class: ... file: ...), tsv with a header line, or jsonl (default: text)')
+	parser.add_argument('--conflicts', action='store_true',
+		help='print duplicate classes as identical copies, conflicting versions or unknown (not comparable, as with --use-jar), instead of all classes')
+	parser.add_argument('--prune', metavar='GLOB', action='append', default=[],
+		help='skip files and dirs matching GLOB (a name, or a path below dirname if it has a /).  can be repeated.  .git is always skipped.')
+	parser.add_argument('--ignore-file', metavar='FILE', action='append', default=[],
+		help='read more --prune globs from FILE, one per line')
+	parser.add_argument('-L', '--follow-links', action='store_true',
+		help='follow symlinked dirs (symlink cycles are skipped)')
+	args = parser.parse_args()
+
+	prune = ['.git'] + args.prune
+	for filename in args.ignore_file:
+		prune += read_ignore_file(filename)
+	rules = walk_rules(prune, args.follow_links)
 
-	args = sys.argv[1:]
-	for javadir in sys.argv:
-		analyze_java(javadir)
+	index = class_index(args.db) if args.db else None
+	if args.conflicts:
+		print_duplicates(find_duplicates(iter_classes(args.dirnames, args.use_jar,
+			max(1, args.jobs), not args.unordered, index, rules, max(0, args.processes))))
+	else:
+		analyze_java(args.dirnames, args.use_jar, max(1, args.jobs), not args.unordered, index, args.format, rules,
+			max(0, args.processes))
+	if index != None:
+		index.close()
 
@@ -29,6 +29,14 @@
 #    # run demo/regression test
 #    maze.py
 #
+#    # save a square, block or micro maze as packed wall bits, and reload it
+#    maze.py -m square -W 10 -H 10 --export maze.mzb
+#    maze.py --load maze.mzb
+#
+#    # compare all templates/maze types with the stored golden outputs
+#    # (add --update-golden to accept new outputs)
+#    maze.py --regress maze-ify-golden
+#
 #    (or import the mazify class and generate your tessellation on
 #    the fly)
 #
@@ -37,6 +45,23 @@
 #    see -h for help and options.  You can give the parser hints about how to
 #    parse the template file (for example, restricting wall lengths)
 #
+# RULE FILES:
+#
+#    extra connector rules for microspace parsing (-s) can be loaded with
+#    --rules FILE, instead of editing imagePreProcess()/imagePostProcess().
+#    rules use the same [find, replace] syntax, one rule per line, under a
+#    [pre] or [post] section header.  lines starting with # are comments.
+#
+#        # connect edges  _|_
+#        [pre]
+#        [ ['_ | _'], ['_+++_'] ],
+#        [ ['_','|'], ['+','|'] ],
+#
+#        [post]
+#        [ ['`','+'], ['_','+'] ],
+#
+#    file rules run after the built-in rules.
+#
 #
 # TEMPLATE EXAMPLES:
 #
@@ -88,20 +113,45 @@
 #   +---+---+---+---+---+---+---+---+---+---+---+---+---+
 #
 
-from random import shuffle, randrange, randint
+from random import shuffle, randrange, randint, seed, random
 #from sets import Set
+from array import array
+from bisect import bisect_left
+from collections import deque
+import ast
+import difflib
 import optparse
+import os
+import re
+import struct
 import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+try:
+	import numpy # optional: vectorized outside detection
+except ImportError:
+	numpy = None
 
 class mazeify:
 
+	# compiled rules, shared by all instances.  see self.compileRules()
+	rule_cache = {} # rule list -> rule_matcher
+	rule_file_cache = {} # (filename, mtime, size) -> rule_matcher sections
+
 	def __init__(self):
 
 		# logging
 		self.debug = False # verbose debugging
+		self.profiler = None # memprofile, see self.phase()
 
 		# data
 		self.board = [[]] # char array for maze. note: 0,0 is top left
+		self.width = 0 # board width. cell index is y*width+x
+		self.use_char_index = True # track positions of unvisited/avoid cells
+		self.char_index = {} # char -> char_positions, see self.buildCharIndex()
 
 		self.deltas = [(0,-1),(0,1),(-1,0),(1,0)] # scan/fill directions: N S E W
 		self.scan_diagonal = True # break diagonal wall patterns
@@ -109,6 +159,7 @@ class mazeify:
 		self.eol = '\n' # expected end-of-line in template
 		self.eol2 = '\n' # rendered end-of-line in ouput
 		self.pad = 1 # whitespace frame used in transform
+		self.use_numpy = numpy != None # vectorize outside detection?
 
 		# wall
 		self.scan_wall_space = True # scan from space that was previously wall
@@ -129,11 +180,50 @@ class mazeify:
 		self.dot_last_underscore = False  # transform "_ " -> "_."?
 		self.close_implied_wall = True  # break wall \_, |_, /_  as "__"?
 		self.bias = {} # track bias in walk pattern 
+		self.rewrite_fixpoint = False # re-apply pre/post rules until nothing changes?
+		self.rules_pre = [] # extra imagePreProcess rules, see self.loadRules()
+		self.rules_post = [] # extra imagePostProcess rules
 
 		# available pre-defined maze tessellations
 		self.maze_types = [ 'square', 'micro','block','oblique','oblique2',
 							'hex','hex2','triangle','diamond']
 
+		self.tessellation = None # (type, w, h) of last self.tessellate()
+
+		# generate these maze types directly on a cell grid, instead of
+		# parsing a template.  see self.createGridMaze()
+		self.use_fast_grid = True
+		self.fast_grid_types = ['square','block']
+
+		# generate these maze types on a precomputed cell graph, also
+		# when self.use_fast_grid is set.  see self.createTopologyMaze()
+		self.topology_types = ['hex','hex2','triangle','diamond']
+
+		# maze types that can be stored as packed wall bits.
+		# see self.toBinary()
+		self.binary_types = ['square','block','micro']
+		self.binary_magic = b'MZB1'
+		self.binary_header = '<4sBIIq' # magic, type, w, h, seed
+
+		# parsing hints for pre-defined maze tessellations
+		self.maze_type_hints = { 
+			'block': {
+				'length': 1,
+			},
+			'diamond': {
+				'use_microspace': True,
+			},
+			'hex': {
+				'use_microspace': True,
+			},
+			'micro': {
+				'use_microspace': True,
+			},
+			'triangle': {
+				'use_microspace': True,
+			},
+		}
+
 		# parse space inside cell for micro-templates.
 		# all chars cells will be converted to 9 cells, where
 		# center char is id.
@@ -178,26 +268,31 @@ class mazeify:
 	# creates maze by default (walks)
 	def parseTemplate(self, template, create_maze=True):
 
-		# apply transform for
-		template = self.transform(template)
-		if self.debug:
-			print("transform:")
-			print(template)
+		with self.phase('parseTemplate'):
 
-		self.board = []
+			# apply transform for
+			template = self.transform(template)
+			if self.debug:
+				print("transform:")
+				print(template)
 
-		# normalize end of line
-		template = template.replace("\r\n",self.eol) # dos
-		if self.eol != "\r":
-			template = template.replace("\r",self.eol) # mac
-		if self.eol != "\n":
-			template = template.replace("\n",self.eol) # nix
+			self.board = []
 
-		lines = template.split(self.eol)
+			# normalize end of line
+			template = template.replace("\r\n",self.eol) # dos
+			if self.eol != "\r":
+				template = template.replace("\r",self.eol) # mac
+			if self.eol != "\n":
+				template = template.replace("\n",self.eol) # nix
 
-		for line in lines:
-			cells = list(line)
-			self.board.append(cells)
+			lines = template.split(self.eol)
+
+			for line in lines:
+				cells = list(line)
+				self.board.append(cells)
+
+			self.width = max(len(row) for row in self.board)
+			self.char_index = {} # built by self.createMaze()
 
 		if create_maze:
 			self.createMaze()
@@ -212,25 +307,32 @@ class mazeify:
 
 	#render maze.  use raw=True to see raw walk/fill data
 	def toString(self, raw=False):
-		s = ''
-		for line in self.board:
-			for cell in line:
-				s += cell
-			s += self.eol2
-
-		if not raw:
-			s = s.replace(self.visited,self.space)
-			# apply inverse transform
-			s = self.inverse_transform(s)
-
-		# sharpen underscore corners
-		if self.dot_last_underscore:
-			for (find,replace) in [('_ ','_.'),(' _','._')]:
-				s = s.replace(find,replace)
+		with self.phase('toString'):
+			s = self.eol2.join(''.join(line) for line in self.board) + self.eol2
+
+			if not raw:
+				s = s.replace(self.visited,self.space)
+				# apply inverse transform
+				s = self.inverse_transform(s)
+
+			# sharpen underscore corners
+			if self.dot_last_underscore:
+				for (find,replace) in [('_ ','_.'),(' _','._')]:
+					s = s.replace(find,replace)
 
 		return s
 
 
+	# profile memory used by a block of code, if self.profiler is set.
+	# for example:
+	#	with self.phase('walk'):
+	#		...
+	def phase(self, name):
+		if self.profiler == None:
+			return nullcontext()
+		return self.profiler.phase(name, self)
+
+
 	# are x,y in bounds?
 	def inBounds(self, x, y, raise_exception=False):
 		if y >= 0 and y < len(self.board) and x >= 0 and x < len(self.board[y]):
@@ -241,6 +343,18 @@ class mazeify:
 		return False
 
 
+	# convert x,y point to flat cell index.
+	# the fill and walk engines track cells as integer indices (y*width+x)
+	# stored in arrays, rather than allocating (x,y) tuples for every cell.
+	def toIndex(self, x, y):
+		return y*self.width + x
+
+
+	# convert flat cell index back to x,y point
+	def toPoint(self, i):
+		return (i % self.width, i // self.width)
+
+
 	# get value at board at x,y
 	def get(self,x,y):
 
@@ -299,11 +413,35 @@ class mazeify:
 		if not self.inBounds(x,y,raise_exception=True):
 			return False
 
+		if self.char_index:
+			self.updateCharIndex(y*self.width + x, self.board[y][x], value)
 		self.board[y][x] = value
 
 		return True
 
 
+	# build an index from character to the set of cell indices holding it.
+	# only unvisited and avoid cells are tracked.  the index is kept up to
+	# date by self.set(), self.setMacroChar() and the fill engine, so lookups
+	# are proportional to the number of matches rather than board area.
+	# called by self.createMaze()
+	def buildCharIndex(self):
+		self.char_index = {}
+		if not self.use_char_index:
+			return
+
+		for c in [self.unvisited, self.avoid]:
+			self.char_index[c] = char_positions(self.findCharIndices(c))
+
+
+	# move cell index i from the old char to the new char in the index
+	def updateCharIndex(self, i, old, new):
+		if old in self.char_index:
+			self.char_index[old].discard(i)
+		if new in self.char_index:
+			self.char_index[new].add(i)
+
+
 	# update a 9-cell macro character
 	# return changed points
 	def setMacroChar(self, x, y, value):
@@ -320,7 +458,7 @@ class mazeify:
 		# is this whitespace?
 		if c1 in [self.visited,self.unvisited]:
 			# safe to replace directly
-			self.board[y][x] = value
+			self.set(x,y,value)
 			changed.append((x,y))
 			return changed
 
@@ -344,7 +482,7 @@ class mazeify:
 					c2 = charmap_old[j][i]
 					if c2 != ' ':
 						(x4,y4) = (x2+i,y2+j)
-						self.board[y4][x4] = value
+						self.set(x4,y4,value)
 						changed.append((x4,y4))
 
 		return changed # all points updated
@@ -353,15 +491,54 @@ class mazeify:
 	# find all points matching a given character
 	# return array of points
 	def findChar(self,find):
-		points = []
+		return [self.toPoint(i) for i in self.findCharIndices(find)]
+
+
+	# like self.findChar(), but returns an array of cell indices
+	def findCharIndices(self,find):
+		if find in self.char_index:
+			return array('i', self.char_index[find])
+
+		indices = array('i')
+		w = self.width
 
 		# scan all cells
 		for y,row in enumerate(self.board):
-			for x,c in enumerate(row):
-				if c == find:
-				 	points.append((x,y))	
-
-		return points
+			x = -1
+			while True:
+				try:
+					x = row.index(find, x+1)
+				except ValueError:
+					break
+				indices.append(y*w + x)
+
+		return indices
+
+
+	# find the first cell index >= start that matches a given character.
+	# optionally restrict the search to a box (x0,y0,x1,y1), exclusive
+	# of x1,y1.  returns -1 if there is no match.
+	def nextCharIndex(self, find, start=0, box=None):
+		w = self.width
+		(x0,y0,x1,y1) = box or (0, 0, w, len(self.board))
+
+		if find in self.char_index:
+			return self.char_index[find].next(start, w, (x0,y0,x1,y1))
+
+		# scan cells
+		for y in range(max(y0, start//w), y1):
+			row = self.board[y]
+			x = x0
+			if y == start//w:
+				x = max(x0, start%w)
+			while True:
+				try:
+					x = row.index(find, x, x1)
+				except ValueError:
+					break
+				return y*w + x
+
+		return -1
 
 
 	# check a 2d rectangular block at point (x,y) for a pattern.
@@ -409,34 +586,51 @@ class mazeify:
 	# this will return an array of top-left points matching the
 	# pattern.  
 	def findPattern(self, find, x=0, y=0):
+		return [self.toPoint(i) for i in self.findPatternIndices(find, x, y)]
 
-		points = []
 
-		h = len(self.board)
-		w = len(self.board[0]) # rectangular
+	# like self.findPattern(), but returns an array of cell indices.
+	# each board row is joined once, then candidates for the first
+	# pattern row are located with str.find and confirmed against the
+	# remaining rows.
+	def findPatternIndices(self, find, x=0, y=0):
+
+		indices = array('i')
 
 		h2 = len(find)
 		if h2 == 0:
-			return []
+			return indices
 
 		w2 = len(find[0])
 		if w2 == 0:
-			return []
+			return indices
+
+		w = self.width
+		rows = [''.join(row) for row in self.board]
+		h = len(rows)
 
-		(rowidx, colidx) = (0,0)
+		# patterns must be rectangular
+		find = [f[:w2] for f in find]
+		head = find[0]
 
 		# scan every cell starting at x,y and up
-		for j in range(y,h):
+		for j in range(y,h-h2+1):
 
 			rowstart = x # skip first row of points 0,x-1
 			if j != y:
 				rowstart = 0
 
-			for i in range(rowstart, w):
-				if self.hasPatternAt(find,i,j):
-					points.append((i,j))	
+			line = rows[j]
+			i = line.find(head, rowstart)
+			while i != -1:
+				for k in range(1,h2):
+					if rows[j+k][i:i+w2] != find[k]:
+						break
+				else:
+					indices.append(j*w + i)
+				i = line.find(head, i+1)
 
-		return points
+		return indices
 
 
 	# get a block of chars starting at top-left x,y, with width,height w,h 
@@ -475,15 +669,210 @@ class mazeify:
 			print("before replace: " + str(find) + ' -> ' + str(replace))
 			print(self.toString(raw=True))
 
-		points = self.findPattern(find)
-		for (x,y) in points:
-			self.setBlock(x, y, replace)
+		w = self.width
+		for i in self.findPatternIndices(find):
+			self.setBlock(i % w, i // w, replace)
 
 		if self.debug:
 			print("after replace: " + str(find) + ' -> ' + str(replace))
 			print(self.toString(raw=True))
 
 
+	# apply a list of [find, replace] rules, or rewrite to a fixpoint with
+	# self.rewrite() if self.rewrite_fixpoint is set.
+	# same result as calling self.replace() for each rule in turn, but the
+	# board is only scanned once for all rules.  see self.applyRules()
+	def replaceRules(self, rules):
+		if self.rewrite_fixpoint:
+			self.rewrite(rules)
+		else:
+			self.applyRules(self.compileRules(rules))
+
+
+	# apply compiled rules (a rule_matcher) in order.
+	# one scan finds the matches of every rule on the board as it is.  a
+	# rule only re-checks the windows that overlap cells changed by the
+	# rules before it, so matches are the same as a full scan per rule.
+	# changed, if given, collects the index of every changed cell.
+	def applyRules(self, matcher, changed=None):
+
+		w = self.width
+		matches = matcher.scan([''.join(row) for row in self.board], w)
+		if changed == None:
+			changed = []
+
+		for k,(find,replace,h2,w2) in enumerate(matcher.rules):
+
+			if self.debug:
+				print("before replace: " + str(find) + ' -> ' + str(replace))
+				print(self.toString(raw=True))
+
+			found = matches[k]
+			if len(changed) > 0:
+				# windows overlapping a changed cell, checked again
+				dirty = set()
+				for i in changed:
+					(x,y) = (i % w, i // w)
+					for y2 in range(max(0,y-h2+1), y+1):
+						for x2 in range(max(0,x-w2+1), x+1):
+							dirty.add(y2*w + x2)
+				found = [i for i in found if not i in dirty]
+				found += [i for i in dirty if self.hasPatternAt(find, i % w, i // w)]
+				found.sort()
+
+			for i in found:
+				(x,y) = (i % w, i // w)
+				for j,line in enumerate(replace):
+					for i2,c in enumerate(line):
+						if self.get(x+i2,y+j) != c:
+							self.set(x+i2, y+j, c)
+							changed.append((y+j)*w + x+i2)
+
+			if self.debug:
+				print("after replace: " + str(find) + ' -> ' + str(replace))
+				print(self.toString(raw=True))
+
+
+	# compile a list of [find, replace] rules into a rule_matcher.
+	# checks that find and replace are lists of strings, and that each
+	# rule is rectangular.  compiled rules are cached.
+	def compileRules(self, rules):
+
+		for rule in rules:
+			if not self.isRule(rule):
+				raise Exception('rule must be [find, replace], two lists of strings: '+str(rule))
+
+		key = tuple((tuple(find), tuple(replace)) for find,replace in rules)
+		if key in self.rule_cache:
+			return self.rule_cache[key]
+
+		compiled = []
+		for (find, replace) in key:
+			if len(find) == 0 or len(find[0]) == 0:
+				continue
+			(h,w) = (len(find), len(find[0]))
+			if ( len(replace) != h 
+					or [len(line) for line in find + replace] != [w]*2*h ):
+				raise Exception('rule is not rectangular: '+str([list(find),list(replace)]))
+			compiled.append((find, replace, h, w))
+
+		matcher = rule_matcher(compiled)
+		self.rule_cache[key] = matcher
+		return matcher
+
+
+	# is rule a [find, replace] pair of lists of strings?
+	def isRule(self, rule):
+		if not isinstance(rule, (list, tuple)) or len(rule) != 2:
+			return False
+		for rows in rule:
+			if not isinstance(rows, (list, tuple)):
+				return False
+			if not all(isinstance(row, str) for row in rows):
+				return False
+		return True
+
+
+	# load extra pre/post processing rules from a rule file.
+	# see RULE FILES at the top of this script for the format.
+	# files are only parsed and compiled once, unless they change on disk.
+	def loadRules(self, filename):
+
+		stat = os.stat(filename)
+		key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+		if not key in self.rule_file_cache:
+			sections = { 'pre': [], 'post': [] }
+			section = None
+
+			with open(filename, "r") as rulefile:
+				for n,line in enumerate(rulefile):
+					line = line.strip()
+					if line == '' or line.startswith('#'):
+						continue
+
+					if line.startswith('[') and line.endswith(']') and line[1:-1] in sections:
+						section = sections[line[1:-1]]
+						continue
+
+					where = filename+':'+str(n+1)
+					if section == None:
+						raise Exception(where+': rule is not under a [pre] or [post] section')
+					try:
+						rule = ast.literal_eval(line.rstrip(','))
+					except (ValueError, SyntaxError):
+						raise Exception(where+': could not parse rule: '+line)
+					if not self.isRule(rule):
+						raise Exception(where+': rule must be [find, replace], two lists of strings: '+line)
+					section.append([list(rule[0]), list(rule[1])])
+
+			self.rule_file_cache[key] = (self.compileRules(sections['pre']),
+											self.compileRules(sections['post']))
+
+		(pre, post) = self.rule_file_cache[key]
+		self.rules_pre = [[list(find),list(replace)] for find,replace,h,w in pre.rules]
+		self.rules_post = [[list(find),list(replace)] for find,replace,h,w in post.rules]
+
+
+	# 2d find/replace to a fixpoint.
+	# like self.replace() for a list of [find, replace] rules, except rules
+	# are re-applied until no rule matches anywhere on the board.  after the
+	# first full scan, only cells whose windows overlap a changed cell are
+	# re-checked (worklist), so chained rules connect without rescanning the
+	# whole board.  max_steps guards against rules that undo each other.
+	def rewrite(self, rules, max_steps=-1):
+
+		w = self.width
+		matcher = self.compileRules(rules)
+		rules = matcher.rules
+		if max_steps == -1:
+			max_steps = len(rules) * w * len(self.board)
+
+		queued = bytearray(w * len(self.board))
+		worklist = deque()
+		steps = 0
+
+		# apply replace pattern at x,y.  queue up changed cells
+		def apply(x, y, find, replace):
+			for j,line in enumerate(replace):
+				for i,c in enumerate(line):
+					if self.get(x+i,y+j) != c:
+						self.set(x+i, y+j, c)
+						i2 = (y+j)*w + x+i
+						if not queued[i2]:
+							queued[i2] = 1
+							worklist.append(i2)
+
+		# first pass: one scan for all rules
+		changed = []
+		self.applyRules(matcher, changed)
+		for i in changed:
+			if not queued[i]:
+				queued[i] = 1
+				worklist.append(i)
+
+		# re-check neighborhoods of changed cells
+		while len(worklist) > 0:
+			i = worklist.popleft()
+			queued[i] = 0
+			(x,y) = (i % w, i // w)
+
+			for find,replace,h2,w2 in rules:
+				for y2 in range(y-h2+1, y+1):
+					for x2 in range(x-w2+1, x+1):
+						if self.hasPatternAt(find, x2, y2):
+							apply(x2, y2, find, replace)
+							steps += 1
+
+			if steps > max_steps:
+				print('Warn: rewrite rules did not reach a fixpoint')
+				break
+
+		if self.debug:
+			print("after rewrite:")
+			print(self.toString(raw=True))
+
+
 	# fill region with char, finding pattern and replacing.  (like
 	# "fill polygon" in a paint program, finds boundaries) this is
 	# a replacement for self.fillRecursive(), where the old function
@@ -508,14 +897,39 @@ class mazeify:
 		if data == None:
 			data = []
 
+		indices = array('i', [self.toIndex(x,y) for (x,y) in points])
+		changed = self.fillIndices(indices, find, replace)
+		data.extend([self.toPoint(i) for i in changed])
+
+		return data
+
+
+	# fill engine.  like self.fillPoints, but takes and returns arrays of
+	# cell indices.  returns the changed cells, in fill order.
+	def fillIndices(self, indices, find, replace):
+
+		changed = array('i')
+
 		if len(find) != len(replace):
 			print('Warn: lengths differ. "'+find+'" -> "'+replace+'"')
 		if find == replace:
 			print('Warn: same find == replace: '+find)
-			return data;
+			return changed
 
-		next_scan = points # init loop
-		walls = []
+		board = self.board
+		w = self.width
+		h = len(board)
+		queued = bytearray(w*h) # cells already changed or queued for scan
+		find_cells = self.char_index.get(find) # keep char index up to date
+		replace_cells = self.char_index.get(replace)
+
+		next_scan = indices # init loop
+		walls = set()
+
+		# count removed wall segments to allow for implicit
+		# wall boundaries.  set with -l flag
+		# for example, (__)(__) = ____
+		count_walls = self.length != -1 and find in self.walls
 
 		# what wall directions will be scanned in ASCII template?
 		# note: these are returned by reference
@@ -530,54 +944,53 @@ class mazeify:
 
 			# process queued set of points
 			points = next_scan # the current working set
-			next_scan = []
-			this_scan = []
+			next_scan = array('i')
+			this_scan = array('i')
 
 			# process point
 			if self.debug:
 				print("")
-				print('fill pre', points, find, replace, level)
-				#print 'fill pre', x, y, find, replace, level
-				#print "macro id ", self.getMacroCharIdPos(x,y), self.getMacroCharValue(x,y)
+				print('fill pre', [self.toPoint(i) for i in points], find, replace)
 				print(self.toString(True))
 
 			# start scanning the set of points
-			for (x,y) in points:
-	
-				x2 = x
-				y2 = y
+			for i in points:
+
+				x2 = i % w
+				y2 = i // w
 				# scan the point and all neighboring points in large straight
 				# paths when possible (minimize recursion)
 				# include current point
-				for (dx,dy) in deltas: 
-
-					finished = False
-					while not finished: 
+				for (dx,dy) in deltas:
 
-						c = self.get(x2,y2)
+					while y2 >= 0 and y2 < h and x2 >= 0:
 
-						if c != find:
+						row = board[y2]
+						if x2 >= len(row) or row[x2] != find:
 							break #not a match
 
 						# pattern was found!
-						self.set(x2,y2,replace)
-
-						# don't retest this cell	
-						data.append((x2,y2))
-						this_scan.append((x2,y2))
-
-						# count removed wall segments to allow for implicit
-						# wall boundaries.  set with -l flag
-						# for example, (__)(__) = ____
-						if self.length != -1 and c in self.walls:
-							(xw,yw) = (x2,y2)
+						row[x2] = replace
+
+						# don't retest this cell
+						i2 = y2*w + x2
+						if find_cells is not None:
+							find_cells.discard(i2)
+						if replace_cells is not None:
+							replace_cells.add(i2)
+						queued[i2] = 1
+						changed.append(i2)
+						this_scan.append(i2)
+
+						if count_walls:
+							iw = i2
 							if self.use_microspace:
-								(xw,yw) = self.getMacroCharTopLeftPos(x2,y2)
-							if not ( (xw,yw) in walls ):
-								walls.append((xw,yw))
+								iw = self.toIndex(*self.getMacroCharTopLeftPos(x2,y2))
+							if not iw in walls:
+								walls.add(iw)
 								if len(walls) >= self.length:
 									# end. maxed out wall segment changes
-									return data
+									return changed
 						x2 += dx
 						y2 += dy
 
@@ -585,29 +998,37 @@ class mazeify:
 				# end for deltas
 
 				if self.debug:
-					print('fill post', x, y, find, replace, level)
+					print('fill post', self.toPoint(i), find, replace)
 					print(self.toString(True))
 
 			# end for points
 
 			# save snapshot of all new neighboring points encountered
-			for (x3,y3) in this_scan:
+			for i3 in this_scan:
+				(x3,y3) = (i3 % w, i3 // w)
 				for (dx,dy) in deltas:
 					x4 = x3 + dx
 					y4 = y3 + dy
-					if self.inBounds(x4,y4) and not ((x4,y4) in next_scan) and not ((x4,y4) in data):
-						next_scan.append((x4,y4))
+					if y4 >= 0 and y4 < h and x4 >= 0 and x4 < len(board[y4]):
+						i4 = y4*w + x4
+						if not queued[i4]:
+							queued[i4] = 1
+							next_scan.append(i4)
 
 		# end while next_scan
 
 		if self.debug:
 			print('**** scan pass done ****')
 
-		return data		
+		return changed
 
 
 	# fill "outside" region of shapes (anything containing ~ avoid)
 	def initOutside(self):
+
+		if self.use_numpy and numpy != None:
+			return self.initOutsideVectorized()
+
 		data = []
 		# flag "outside of shape"
 		if self.pad > 0:
@@ -626,6 +1047,81 @@ class mazeify:
 			print("**** init complete ****")
 
 
+	# like self.initOutside(), but computed with numpy array operations.
+	# the result is the same: every whitespace region (N S E W connected,
+	# crossing ~ cells) that touches the frame at 0,0 or holds an avoid char
+	# is flagged as visited.
+	#
+	# reachability is spread along whole runs of open cells at a time,
+	# alternating rows and columns, so the number of passes depends on how
+	# many turns a region takes rather than how many cells it holds.
+	def initOutsideVectorized(self):
+
+		w = self.width
+		h = len(self.board)
+
+		# board as an h x w array of code points. short rows padded with 0
+		text = ''.join(''.join(row).ljust(w, '\0') for row in self.board)
+		cells = numpy.frombuffer(text.encode('utf-32-le'), dtype=numpy.uint32)
+		cells = cells.reshape((h,w))
+
+		is_avoid = cells == ord(self.avoid)
+		is_open = (cells == ord(self.unvisited)) | is_avoid
+
+		reached = is_avoid.copy()
+		if self.pad > 0 and is_open[0,0] and not is_avoid[0,0]:
+			reached[0,0] = True
+
+		count = -1
+		while count != numpy.count_nonzero(reached):
+			count = numpy.count_nonzero(reached)
+			reached = self.spreadRuns(is_open, reached)
+			reached = self.spreadRuns(is_open.T, reached.T).T
+
+		# write back flagged cells
+		indices = numpy.flatnonzero(reached)
+		if self.debug:
+			print("outside cells", len(indices))
+
+		for c in [self.unvisited, self.avoid]:
+			if c in self.char_index:
+				self.char_index[c].difference_update(indices.tolist())
+
+		for y in numpy.flatnonzero(reached.any(axis=1)).tolist():
+			row = self.board[y]
+			for x in numpy.flatnonzero(reached[y]).tolist():
+				row[x] = self.visited
+
+		if self.debug:
+			print("**** init complete ****")
+
+
+	# mark every run of open cells along a row that holds a reached cell.
+	# takes and returns 2d boolean arrays.
+	def spreadRuns(self, is_open, reached):
+
+		(h,w) = is_open.shape
+
+		# add a closed column so runs never wrap onto the next row
+		is_open2 = numpy.zeros((h,w+1), dtype=bool)
+		is_open2[:,:w] = is_open
+		reached2 = numpy.zeros((h,w+1), dtype=bool)
+		reached2[:,:w] = reached
+		is_open2 = is_open2.ravel()
+		reached2 = reached2.ravel()
+
+		# label runs 1..n.  closed cells are 0
+		starts = is_open2.copy()
+		starts[1:] &= ~is_open2[:-1]
+		runs = numpy.cumsum(starts) * is_open2
+
+		hit = numpy.zeros(numpy.count_nonzero(starts)+1, dtype=bool)
+		hit[runs[reached2 & is_open2]] = True
+		hit[0] = False
+
+		return hit[runs].reshape((h,w+1))[:,:w] | reached
+
+
 	# rules to connect known edge patterns between 3x3 macrospace characters.
 	# ignore some micro space between fonts, and tighten up graph prior to
 	# walk().  
@@ -686,10 +1182,9 @@ class mazeify:
 
 			# add more connector rules here ...
 
-		]	
+		] + self.rules_pre
 
-		for find,replace in patterns:
-			self.replace(find,replace)
+		self.replaceRules(patterns)
 
 
 	# post image processing.  clean up implied horizontal/vertical wall
@@ -721,19 +1216,24 @@ class mazeify:
 		if self.close_implied_wall:
 			patterns.append([['`','+'] , ['_','+']])
 
-		for find,replace in patterns:
-			self.replace(find,replace)
+		patterns += self.rules_post
+
+		self.replaceRules(patterns)
 
 
 	# scan the entire ASCII map, build the maze
 	def createMaze(self):
 
+		self.buildCharIndex()
+
 		if self.use_microspace:
-			self.imagePreProcess()
+			with self.phase('imagePreProcess'):
+				self.imagePreProcess()
 			if self.debug:
 				print("**** imagePreProcess complete ****")
 
-		self.initOutside()
+		with self.phase('initOutside'):
+			self.initOutside()
 
 		# aim start in for middle.
 		h = len(self.board)-1
@@ -742,21 +1242,22 @@ class mazeify:
 		ystart = randint(0,3* h//4)
 		xstart = randint(0,3* w//4)
 
-		data = [] # track where we've checked
-		for y in range(ystart, h):
-			for x in range(xstart,w):
-				c = self.get(x,y)
-				if c == self.unvisited:
-				 	self.walk(x,y,0,data)	
+		with self.phase('walk'):
+			box = (xstart, ystart, w, h)
+			i = self.nextCharIndex(self.unvisited, 0, box)
+			while i != -1:
+				self.walk(*self.toPoint(i))
+				i = self.nextCharIndex(self.unvisited, i+1, box)
 
-		# scan all cells
-		for y,row in enumerate(self.board):
-			for x,c in enumerate(row):
-				if c == self.unvisited:
-				 	self.walk(x,y,0,data)	
+			# scan all cells
+			i = self.nextCharIndex(self.unvisited)
+			while i != -1:
+				self.walk(*self.toPoint(i))
+				i = self.nextCharIndex(self.unvisited, i+1)
 
 		if self.use_microspace:
-			self.imagePostProcess()
+			with self.phase('imagePostProcess'):
+				self.imagePostProcess()
 			if self.debug:
 				print("**** imagePostProcess complete ****")
 
@@ -788,26 +1289,31 @@ class mazeify:
 	# walk around, knock down walls starting at x,y position
 	def walk(self,x=0,y=0,level=0,data=None):
 
-		if level == 0:
-			data = []
+		if level == 0 or data == None:
 			self.bias = {} # reset walk biases
+			data = bytearray(len(self.board)*self.width) # cells scanned
+
+		self.walkIndex(self.toIndex(x,y), data)
+
+
+	# walk engine.  like self.walk, but starts at cell index i.
+	# data flags every cell index that has already been scanned.
+	def walkIndex(self,i,data):
 
 		## optimize walk: only run one full scan on each space
-		if (x,y) in data:
-			return data
-		else:
-			data.append((x,y))
+		if data[i]:
+			return
+		data[i] = 1
 
-		c = self.get(x,y) # current char
+		w = self.width
+		(x,y) = (i % w, i // w)
 
 		# scan pattern
 		deltas = self.getDeltas() 
 		for delta in deltas:
 
-	
 			(dx,dy) = delta
 
-
 			x2 = x
 			y2 = y
 			foundwall = False	
@@ -815,8 +1321,7 @@ class mazeify:
 			scan = ''
 
 			# look past walls for unvisited rooms 		
-			path = []
-			walls = []
+			walls = array('i')
 			wall = ''
 			wallsize = 0
 
@@ -825,7 +1330,6 @@ class mazeify:
 				y2 += dy
 				scan = self.get(x2,y2) # look ahead char
 
-				path.append((x2,y2))
 				if scan ==  '':
 					finished = True   # dead end
 				elif scan in self.corners:
@@ -838,7 +1342,7 @@ class mazeify:
 						finished = True # gone through too many walls
 					foundwall = True # inside a wall
 					wall = scan
-					walls.append((x2,y2))
+					walls.append(y2*w + x2)
 				elif foundwall: # scan not in self.walls
 					finished = True # scan moved past the wall
 
@@ -851,39 +1355,319 @@ class mazeify:
 				else:
 					self.bias[delta] += 1
 
-				changed = []
-
 				# knock down wall.  note: must use a delimiter/change
 				# or parser won't know where the wall segment boundary ends
-				walls_changed=[]
-				for point in walls:
-					(x3,y3) = point
-					c = self.get(x3,y3)
+				walls_changed = array('i')
+				for i3 in walls:
+					c = self.board[i3 // w][i3 % w]
 					
 					#replace = self.getReplaceChar(x3,y3,dx,dy,c)
 					replace = self.unvisited
 					
-					changed = self.fill(x3,y3,c,replace) # hulk smash!
-					walls_changed += changed
+					walls_changed += self.fillIndices(array('i',[i3]),c,replace) # hulk smash!
 
 				# claim empty room
-				changed = self.fill(x2,y2,self.unvisited,self.visited)
+				changed = self.fillIndices(array('i',[y2*w + x2]),self.unvisited,self.visited)
 				shuffle(changed)
 
 				# rescan from every newly discovered space.
 				# note: this is re-scanning from inside previous wall-space.
 				# this is intentional (in case walls are staggered).
-				if (x,y) in changed:
-					changed.remove((x,y)) # don't rescan from the initial point
+				if i in changed:
+					changed.remove(i) # don't rescan from the initial point
 
 				if not self.scan_wall_space:
-					for point in walls_changed:
-						if point in walls_changed:
-							walls_changed.remove(point) # don't scan wall space
+					for i3 in walls_changed:
+						if i3 in walls_changed:
+							walls_changed.remove(i3) # don't scan wall space
+
+				for i2 in changed:
+					self.walkIndex(i2,data)
+
+
+	# create a predefined maze type of w x h cells, with parsing hints.
+	# square and block mazes are generated on a cell grid with
+	# self.createGridMaze(), hex, hex2, triangle and diamond mazes on a
+	# cell graph with self.createTopologyMaze(), when self.use_fast_grid
+	# is set.  the fast paths don't parse a template, so any parsing
+	# option (see self.hasParsingOptions()) falls back to the template.
+	def createPredefinedMaze(self, type, w, h):
+
+		fast = self.use_fast_grid and not self.hasParsingOptions(type)
+
+		if fast and type in self.fast_grid_types:
+			self.createGridMaze(type, w, h)
+			return
+
+		if fast and type in self.topology_types:
+			self.createTopologyMaze(type, w, h)
+			return
+
+		template = self.tessellate(w, h, type)
+
+		# parsing hints
+		hints = self.maze_type_hints
+		if type in hints:
+			hint = hints[type]
+			for k in hint:
+				if self.debug:
+					print(k, hint[k])
+				self.__dict__[k] = hint[k]
+
+		self.parseTemplate(template)
+
+
+	# are any template parsing options changed from their defaults?
+	# (-s, -t, -l, -z, --no-close-implied-wall, --no-wall-scan, --fixpoint,
+	# --rules).  options set by the parsing hints of type do not count,
+	# the hints override them anyway.
+	def hasParsingOptions(self, type=None):
+		hint = self.maze_type_hints.get(type, {})
+		changed = {
+			'use_microspace': self.use_microspace,
+			'close_implied_wall': not self.close_implied_wall,
+			'thickness': self.thickness != 1,
+			'length': self.length != -1,
+			'scan_diagonal': not self.scan_diagonal,
+			'scan_wall_space': not self.scan_wall_space,
+			'rewrite_fixpoint': self.rewrite_fixpoint,
+			'rules_pre': len(self.rules_pre) > 0,
+			'rules_post': len(self.rules_post) > 0,
+		}
+		return any(changed[k] and not k in hint for k in changed)
+
+
+	# fast path for regular grids (square, block).
+	# carve a w x h maze with an iterative depth first walk over packed
+	# wall bits (see self.getWallBits()), then render it in the same ASCII
+	# style as the template.  no template scanning or flood fills.
+	def createGridMaze(self, type, w, h):
+
+		bits = bytearray([3]) * (w*h) # all east and south walls up
+		visited = bytearray(w*h)
+
+		start = randrange(w*h)
+		visited[start] = 1
+		stack = [start]
+
+		while len(stack) > 0:
+			i = stack[-1]
+			(x,y) = (i % w, i // w)
+
+			# unvisited neighbors
+			paths = []
+			if x > 0 and not visited[i-1]:
+				paths.append(i-1)
+			if x < w-1 and not visited[i+1]:
+				paths.append(i+1)
+			if y > 0 and not visited[i-w]:
+				paths.append(i-w)
+			if y < h-1 and not visited[i+w]:
+				paths.append(i+w)
+
+			if len(paths) == 0:
+				stack.pop() # dead end, back up
+				continue
+
+			# knock down wall between i and i2
+			i2 = paths[int(random()*len(paths))]
+			if i2 == i+1:
+				bits[i] &= ~1
+			elif i2 == i-1:
+				bits[i2] &= ~1
+			elif i2 == i+w:
+				bits[i] &= ~2
+			else:
+				bits[i2] &= ~2
+
+			visited[i2] = 1
+			stack.append(i2)
+
+		self.tessellation = (type, w, h)
+		self.use_microspace = False
+		self.parseTemplate(self.renderWallBits(type, w, h, bits), create_maze=False)
+
+
+	# cell graph of a hex, hex2, triangle or diamond tessellation, as laid
+	# out by self.tessellate().  returns (n, walls, centers), where n is
+	# the number of rooms, walls is a list of (room, room, glyphs): the two
+	# rooms a wall separates, and the template (x,y) positions of its
+	# chars, and centers is the template (x,y) center of each room.
+	# half rooms on the border are outside the maze and left out.
+	def getTopology(self, type, w, h):
 
-				for point in changed:
-					(x2,y2) = point
-					self.walk(x2,y2,level+1,data)
+		rooms = {} # (kind, column, row) -> room id
+		walls = []
+		centers = []
+
+		def room(key, x, y):
+			rooms[key] = len(rooms)
+			centers.append((x, y))
+
+		if type == 'hex':
+			# A: hex in column k, B: hex between columns k and k+1
+			for k in range(w):
+				for i in range(h):
+					room(('A',k,i), 6*k+1.5, 2*i+1.5)
+			for k in range(w):
+				for i in range(h-1):
+					room(('B',k,i), 6*k+4.5, 2*i+2.5)
+
+			for k in range(w):
+				for i in range(h):
+					x = 6*k
+					y = 2*i
+					walls += [
+						(('A',k,i), ('A',k,i+1), [(x+1,y+2),(x+2,y+2)]),
+						(('B',k,i), ('B',k,i+1), [(x+4,y+3),(x+5,y+3)]),
+						(('A',k,i), ('B',k,i), [(x+3,y+2)]),
+						(('A',k,i+1), ('B',k,i), [(x+3,y+3)]),
+						(('A',k+1,i), ('B',k,i), [(x+6,y+2)]),
+						(('A',k+1,i+1), ('B',k,i), [(x+6,y+3)]),
+					]
+
+		elif type == 'hex2':
+			for k in range(w):
+				for i in range(h):
+					room(('A',k,i), 12*k+3.5, 4*i+2.5)
+			for k in range(w-1):
+				for i in range(h-1):
+					room(('B',k,i), 12*k+9.5, 4*i+4.5)
+
+			for k in range(w):
+				for i in range(h):
+					x = 12*k
+					y = 4*i
+					walls += [
+						(('A',k,i), ('A',k,i+1), [(x+2,y+4),(x+3,y+4),(x+4,y+4),(x+5,y+4)]),
+						(('B',k,i), ('B',k,i+1), [(x+8,y+6),(x+9,y+6),(x+10,y+6),(x+11,y+6)]),
+						(('A',k,i), ('B',k,i), [(x+7,y+3),(x+6,y+4)]),
+						(('A',k,i+1), ('B',k,i), [(x+6,y+5),(x+7,y+6)]),
+						(('A',k+1,i), ('B',k,i), [(x+12,y+3),(x+13,y+4)]),
+						(('A',k+1,i+1), ('B',k,i), [(x+13,y+5),(x+12,y+6)]),
+					]
+
+		elif type == 'triangle':
+			# U/V: up/down triangles in column k, D/W: down/up triangles
+			# between columns k and k+1.  one row p per 4 template lines.
+			for p in range(h//2):
+				for k in range(w):
+					room(('U',k,p), 4*k+1.5, 4*p+1.5)
+					room(('V',k,p), 4*k+1.5, 4*p+3.5)
+				for k in range(w-1):
+					room(('D',k,p), 4*k+3.5, 4*p+1.5)
+					room(('W',k,p), 4*k+3.5, 4*p+3.5)
+
+			for p in range(h//2):
+				for k in range(w):
+					x = 4*k
+					y = 4*p
+					walls += [
+						(('U',k,p), ('D',k-1,p), [(x+1,y+1),(x,y+2)]),
+						(('U',k,p), ('D',k,p), [(x+2,y+1),(x+3,y+2)]),
+						(('U',k,p), ('V',k,p), [(x+1,y+2),(x+2,y+2)]),
+						(('V',k,p), ('W',k-1,p), [(x,y+3),(x+1,y+4)]),
+						(('V',k,p), ('W',k,p), [(x+3,y+3),(x+2,y+4)]),
+						(('W',k,p), ('D',k,p+1), [(x+3,y+4),(x+4,y+4)]),
+					]
+
+		elif type == 'diamond':
+			# P: diamond in column k, Q: diamond between columns
+			for k in range(w):
+				for i in range(h):
+					room(('P',k,i), 2*k+0.5, 2*i+0.5)
+			for k in range(w-1):
+				for i in range(h-1):
+					room(('Q',k,i), 2*k+1.5, 2*i+1.5)
+
+			for k in range(w):
+				for i in range(h):
+					x = 2*k
+					y = 2*i
+					walls += [
+						(('P',k,i), ('Q',k,i), [(x+1,y+1)]),
+						(('P',k+1,i), ('Q',k,i), [(x+2,y+1)]),
+						(('P',k,i+1), ('Q',k,i), [(x+1,y+2)]),
+						(('P',k+1,i+1), ('Q',k,i), [(x+2,y+2)]),
+					]
+
+		else:
+			raise Exception('maze type has no cell graph: '+str(type))
+
+		# drop walls that face the border
+		walls = [(rooms[a], rooms[b], glyphs) for (a, b, glyphs) in walls
+				if a in rooms and b in rooms]
+
+		return (len(rooms), walls, centers)
+
+
+	# fast path for hex, hex2, triangle and diamond mazes.
+	# carve a spanning tree over the cell graph from self.getTopology()
+	# with an iterative depth first walk, then erase the open walls from
+	# the template.  the result is laid out directly, no 9x microspace
+	# board is built.
+	def createTopologyMaze(self, type, w, h):
+
+		(n, walls, centers) = self.getTopology(type, w, h)
+
+		# room -> list of (room, wall)
+		paths = [[] for i in range(n)]
+		for (j, (a, b, glyphs)) in enumerate(walls):
+			paths[a].append((b, j))
+			paths[b].append((a, j))
+
+		visited = bytearray(n)
+		opened = []
+
+		# random start, then any rooms cut off from it (narrow mazes)
+		starts = [randrange(n)] + list(range(n)) if n > 0 else []
+		for start in starts:
+			if visited[start]:
+				continue
+			visited[start] = 1
+			stack = [start]
+
+			while len(stack) > 0:
+				i = stack[-1]
+
+				# unvisited neighbors
+				paths2 = [p for p in paths[i] if not visited[p[0]]]
+				if len(paths2) == 0:
+					stack.pop() # dead end, back up
+					continue
+
+				(i2, j) = paths2[int(random()*len(paths2))]
+				opened.append(j)
+				visited[i2] = 1
+				stack.append(i2)
+
+		# knock down walls in the template
+		lines = [list(line) for line in self.tessellate(w, h, type).split(self.eol)]
+		for j in opened:
+			for (x,y) in walls[j][2]:
+				lines[y][x] = self.space
+
+		self.use_microspace = False
+
+		if not self.maze_type_hints.get(type, {}).get('use_microspace', False):
+			self.parseTemplate(self.eol.join(''.join(line) for line in lines), create_maze=False)
+			return
+
+		# the glyphs are final, skip the 9x board
+		self.layoutMicrospace([''.join(line) for line in lines])
+
+
+	# set the board to template lines as the microspace round trip
+	# (self.transform(), then self.toString()) renders them, without
+	# building the 9x board.  the round trip pads all lines to the width
+	# of the longest one (trailing space included), renders the top row
+	# of the whitespace frame as an empty line (it does not fill a whole
+	# 3x3 cell), and ends with the empty row that the last eol of the
+	# transform leaves.  the hex, triangle and diamond goldens pin this.
+	def layoutMicrospace(self, lines):
+		self.width = max(len(line) for line in lines)
+		self.board = [[]] + [list(line.rstrip().ljust(self.width)) for line in lines] + [[]]
+		self.char_index = {}
 
 
 	# generate basic ASCII tessellations
@@ -895,6 +1679,8 @@ class mazeify:
 			print(self.maze_types)
 			return ''	
 
+		self.tessellation = (type, w, h)
+
 		#all patterns
 		patterns = {}
 		
@@ -1091,6 +1877,205 @@ class mazeify:
 		return transform
 
 
+	# read the walls of a finished square, block or micro maze.
+	# returns a bytearray with one entry per cell (row major), where
+	# bit 0 is set for an east wall and bit 1 for a south wall.
+	# the outer border counts as walls.
+	def getWallBits(self, type=None, w=None, h=None):
+
+		if type == None:
+			(type, w, h) = self.tessellation
+		if not type in self.binary_types:
+			raise Exception('maze type can not be stored as wall bits: '+str(type))
+
+		lines = self.toString().split(self.eol2)
+
+		# find top left corner of maze
+		oy = 0
+		while lines[oy].strip() == '':
+			oy += 1
+		ox = len(lines[oy]) - len(lines[oy].lstrip())
+
+		def wall(x,y):
+			line = lines[oy+y]
+			return ox+x < len(line) and line[ox+x] not in [self.space, self.visited]
+
+		bits = bytearray(w*h)
+		for j in range(h):
+			for i in range(w):
+				if type == 'micro':
+					line = lines[oy+j+1]
+					east = line[ox+2*i+2] == '|' # open wall is drawn as a floor
+					south = line[ox+2*i+1] == '_'
+				else:
+					east = wall(4*i+4, 2*j+1)
+					south = wall(4*i+2, 2*j+2)
+				bits[j*w+i] = east | (south << 1)
+
+		return bits
+
+
+	# render wall bits (see self.getWallBits()) back into an ASCII template
+	# in the same style as self.tessellate(), with open walls removed.
+	def renderWallBits(self, type, w, h, bits):
+
+		def east(i,j):
+			return bits[j*w+i] & 1
+
+		def south(i,j):
+			return bits[j*w+i] & 2
+
+		eol = self.eol
+		lines = []
+
+		if type == 'square':
+			lines.append('+---' * w + '+')
+			for j in range(h):
+				lines.append('|' + ''.join('   ' + ('|' if east(i,j) else ' ') for i in range(w)))
+				lines.append('+' + ''.join(('---' if south(i,j) else '   ') + '+' for i in range(w)))
+
+		elif type == 'block':
+			lines.append('#`' * (2*w+1))
+			for j in range(h):
+				lines.append('#' + ''.join('   ' + ('#' if east(i,j) else ' ') for i in range(w)))
+				lines.append('#' + ''.join('`' + ('#' if south(i,j) else ' ') + '`#' for i in range(w)) + '`')
+
+		elif type == 'micro':
+			lines.append('_' + '_' * 2*w)
+			for j in range(h):
+				lines.append('|' + ''.join(('_' if south(i,j) else ' ') + ('|' if east(i,j) else '_') for i in range(w)))
+
+		else:
+			raise Exception('maze type can not be stored as wall bits: '+str(type))
+
+		return eol.join(lines) + eol
+
+
+	# export finished maze as packed wall bits: a small header (magic, type,
+	# width, height, seed) followed by 2 bits per cell, 4 cells per byte.
+	# about 1/30th the size of the ASCII rendering.
+	def toBinary(self, seed=-1):
+
+		(type, w, h) = self.tessellation
+		bits = self.getWallBits(type, w, h)
+
+		packed = bytearray((len(bits)+3)//4)
+		for n,b in enumerate(bits):
+			packed[n//4] |= b << (2*(n%4))
+
+		header = struct.pack(self.binary_header, self.binary_magic,
+					self.binary_types.index(type), w, h, seed)
+		return header + bytes(packed)
+
+
+	# load a maze exported with self.toBinary().  rebuilds the board (no
+	# walk), so self.toString() renders the maze.  returns the header
+	# as a dict with type, width, height and seed.
+	def fromBinary(self, data):
+
+		size = struct.calcsize(self.binary_header)
+		(magic, code, w, h, seed) = struct.unpack(self.binary_header, data[:size])
+		if magic != self.binary_magic or code >= len(self.binary_types):
+			raise Exception('not a binary maze file')
+
+		type = self.binary_types[code]
+		packed = data[size:]
+		if len(packed) < (w*h+3)//4:
+			raise Exception('binary maze file is truncated')
+
+		bits = bytearray(w*h)
+		for n in range(w*h):
+			bits[n] = (packed[n//4] >> (2*(n%4))) & 3
+
+		self.tessellation = (type, w, h)
+		self.use_microspace = (type == 'micro')
+		self.parseTemplate(self.renderWallBits(type, w, h, bits), create_maze=False)
+
+		return { 'type': type, 'width': w, 'height': h, 'seed': seed }
+
+
+	# export maze topology as numpy arrays, for analysis.
+	# returns (rooms, edges), where rooms is an n x 2 array with the
+	# template (x,y) center of each room (as laid out by self.tessellate())
+	# and edges is an m x 2 array of room id pairs joined by an open
+	# passage.  works on any predefined maze type.  requires numpy.
+	def toGraph(self):
+
+		if numpy == None:
+			raise Exception('numpy is required to export a maze graph')
+		if self.tessellation == None:
+			raise Exception('maze graph needs a predefined maze type, not a template')
+
+		(type, w, h) = self.tessellation
+
+		if type in self.binary_types:
+			# rooms in row major order, read from the wall bits
+			bits = numpy.frombuffer(bytes(self.getWallBits(type, w, h)), dtype=numpy.uint8)
+			bits = bits.reshape((h,w))
+			ids = numpy.arange(w*h, dtype=numpy.int32).reshape((h,w))
+			(ys, xs) = numpy.mgrid[0:h, 0:w]
+			if type == 'micro':
+				centers = numpy.stack([2*xs+1, ys+1], axis=2)
+			else:
+				centers = numpy.stack([4*xs+2, 2*ys+1], axis=2)
+
+			# open east walls join room to room+1, open south walls to room+w
+			east = (bits[:,:-1] & 1) == 0
+			south = (bits[:-1,:] & 2) == 0
+			edges = numpy.concatenate([
+				numpy.stack([ids[:,:-1][east], ids[:,1:][east]], axis=1),
+				numpy.stack([ids[:-1,:][south], ids[1:,:][south]], axis=1),
+			])
+
+			return (centers.reshape((w*h,2)).astype(numpy.float64), edges.astype(numpy.int32))
+
+		# other types: a wall of the cell graph is open when all its chars
+		# are blank on the finished board.  line up the board with a fresh
+		# template by the first line (the top border is never opened).
+		(n, walls, centers) = self.getTopology(type, w, h)
+		template = self.tessellate(w, h, type).split(self.eol)
+		lines = self.toString().split(self.eol2)
+
+		def top(lines):
+			y = 0
+			while lines[y].strip() == '':
+				y += 1
+			return (len(lines[y]) - len(lines[y].lstrip()), y)
+
+		(tx, ty) = top(template)
+		(bx, by) = top(lines)
+		(ox, oy) = (bx - tx, by - ty)
+
+		blank = [self.space, self.visited]
+		if self.dot_last_underscore:
+			blank.append('.')
+
+		def opened(x,y):
+			line = lines[oy+y] if 0 <= oy+y < len(lines) else ''
+			return not (0 <= ox+x < len(line)) or line[ox+x] in blank
+
+		edges = []
+		for (a, b, glyphs) in walls:
+			open_glyphs = sum(1 for (x,y) in glyphs if opened(x,y))
+			if open_glyphs == len(glyphs):
+				edges.append((a, b))
+			elif open_glyphs > 0:
+				# half a wall knocked out, the walk did not follow the
+				# cell graph (e.g. triangles parsed as a template)
+				raise Exception('maze does not follow the '+type+' cell graph, can not export it')
+
+		return (numpy.array(centers, dtype=numpy.float64).reshape((n,2)),
+			numpy.array(edges, dtype=numpy.int32).reshape((len(edges),2)))
+
+
+	# save self.toGraph() as a compressed .npz file with arrays rooms,
+	# edges and type
+	def saveGraph(self, filename):
+		(rooms, edges) = self.toGraph()
+		numpy.savez_compressed(filename, rooms=rooms, edges=edges,
+			type=numpy.array(self.tessellation[0]))
+
+
 	# print board with all x,y indexes, for debugging
 	def dump(self):
 		for y,row in enumerate(self.board):
@@ -1137,6 +2122,205 @@ a test template
 
 # end class
 
+
+# cell indices holding one char, for mazeify.char_index.  a set for
+# membership, and a sorted list to find the next index with bisect.
+# removed indices stay in the list (stale) until it is compacted.
+class char_positions:
+
+	def __init__(self, indices=()):
+		self.cells = set(indices)
+		self.order = sorted(self.cells)
+		self.stale = 0 # removed indices still in self.order
+
+
+	def __contains__(self, i):
+		return i in self.cells
+
+
+	def __len__(self):
+		return len(self.cells)
+
+
+	# indices in order
+	def __iter__(self):
+		cells = self.cells
+		return (i for i in self.order if i in cells)
+
+
+	def add(self, i):
+		if i in self.cells:
+			return
+		self.cells.add(i)
+		k = bisect_left(self.order, i)
+		if k < len(self.order) and self.order[k] == i:
+			self.stale -= 1 # was stale, listed again
+		else:
+			self.order.insert(k, i)
+
+
+	def discard(self, i):
+		if not i in self.cells:
+			return
+		self.cells.remove(i)
+		self.stale += 1
+		if self.stale > 32 and 2*self.stale > len(self.order):
+			self.order = [i2 for i2 in self.order if i2 in self.cells]
+			self.stale = 0
+
+
+	def difference_update(self, indices):
+		for i in indices:
+			self.discard(i)
+
+
+	# first index >= start inside box (x0,y0,x1,y1), exclusive of x1,y1,
+	# of a board w cells wide.  returns -1 if there is none.
+	def next(self, start, w, box):
+		(x0,y0,x1,y1) = box
+		order = self.order
+		k = bisect_left(order, max(start, y0*w + x0))
+		while k < len(order):
+			i = order[k]
+			(x,y) = (i % w, i // w)
+			if y >= y1:
+				break
+			if x < x0:
+				k = bisect_left(order, y*w + x0, k) # skip to the box
+			elif x >= x1:
+				k = bisect_left(order, (y+1)*w + x0, k) # next row
+			elif i in self.cells:
+				return i
+			else:
+				k += 1 # stale
+		return -1
+
+
+# [find, replace] rules compiled for mazeify.applyRules().
+# rules are (find, replace, height, width) tuples.  the first char of
+# each find pattern is indexed, so one regex scan of the board finds the
+# candidate matches of every rule at once.
+class rule_matcher:
+
+	def __init__(self, rules):
+		self.rules = rules
+		self.first = {} # first char -> indices of the rules starting with it
+		for k,(find,replace,h,w) in enumerate(rules):
+			self.first.setdefault(find[0][0], []).append(k)
+		self.regex = re.compile('[' + ''.join(re.escape(c) for c in sorted(self.first)) + ']')
+
+
+	# find the matches of every rule in the board rows (strings), as a list
+	# of cell index lists, one per rule.  w is the board width.
+	def scan(self, rows, w):
+		matches = [[] for rule in self.rules]
+		if len(self.rules) == 0:
+			return matches
+
+		h = len(rows)
+		for j,line in enumerate(rows):
+			for m in self.regex.finditer(line):
+				i = m.start()
+				for k in self.first[line[i]]:
+					(find,replace,h2,w2) = self.rules[k]
+					if j + h2 > h:
+						continue
+					for t in range(h2):
+						if not rows[j+t].startswith(find[t], i):
+							break
+					else:
+						matches[k].append(j*w + i)
+		return matches
+
+
+# per-phase memory profiler, using tracemalloc.
+# mazeify.phase() records the peak memory allocated during each phase
+# (parseTemplate, initOutside, walk, toString, ...), the bytes per board
+# cell, and the top allocation sites.  see --memprofile
+# phases can nest (toString in debug mode runs inside other phases).  an
+# inner phase resets the tracemalloc peak, so the peak seen so far by
+# each outer phase is kept on a stack and merged back when it ends.
+class memprofile:
+
+	def __init__(self, top=5):
+		self.top = top # number of allocation sites to report per phase
+		self.phases = [] # (name, peak bytes, board cells, top allocation sites)
+		self.stack = [] # peak bytes seen so far by each open phase
+		self.filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+
+	# profile a block of code as a named phase of maze
+	@contextmanager
+	def phase(self, name, maze):
+		before = tracemalloc.take_snapshot().filter_traces(self.filters)
+		(start, peak) = tracemalloc.get_traced_memory()
+		if len(self.stack) > 0:
+			self.stack[-1] = max(self.stack[-1], peak)
+		self.stack.append(start)
+		tracemalloc.reset_peak()
+		try:
+			yield
+		finally:
+			(current, peak) = tracemalloc.get_traced_memory()
+			peak = max(self.stack.pop(), peak)
+			if len(self.stack) > 0:
+				self.stack[-1] = max(self.stack[-1], peak)
+			tracemalloc.reset_peak()
+			after = tracemalloc.take_snapshot().filter_traces(self.filters)
+			sites = after.compare_to(before, 'lineno')[:self.top]
+			cells = maze.width * len(maze.board)
+			self.phases.append((name, peak - start, cells, sites))
+
+
+	# render report
+	def toString(self):
+		s = 'memory profile (peak bytes allocated per phase)\n'
+		s += 'phase'.ljust(20) + 'peak bytes'.rjust(14) + 'cells'.rjust(12) + 'bytes/cell'.rjust(12) + '\n'
+		for (name, peak, cells, sites) in self.phases:
+			per_cell = float(peak) / cells if cells > 0 else 0.0
+			s += name.ljust(20) + str(peak).rjust(14) + str(cells).rjust(12) + ('%.1f' % per_cell).rjust(12) + '\n'
+
+		peak = max([0] + [phase[1] for phase in self.phases])
+		s += 'max peak bytes: ' + str(peak) + '\n'
+
+		for (name, peak, cells, sites) in self.phases:
+			s += '\n' + 'top allocation sites (net bytes): ' + name + '\n'
+			for site in sites:
+				frame = site.traceback[0]
+				s += str(site.size_diff).rjust(14) + ' B  ' + frame.filename + ':' + str(frame.lineno) + '\n'
+
+		return s
+
+
+# run one regression job in a worker process.
+# a job is a dict with keys:
+#    name      job name (golden output file name)
+#    seed      random seed
+#    maze      predefined maze type, or '' to parse template
+#    template  ASCII template
+#    width     predefined maze width
+#    height    predefined maze height
+#    hints     parser attributes to set, for example {'use_microspace': True}
+# returns (name, rendered output, seconds)
+def run_regression_job(job):
+
+	seed(job['seed'])
+	start = time.time()
+
+	maze = mazeify()
+	for k in job['hints']:
+		maze.__dict__[k] = job['hints'][k]
+
+	if job['maze'] != '':
+		maze.createPredefinedMaze(job['maze'], job['width'], job['height'])
+	else:
+		maze.parseTemplate(job['template'])
+	out = maze.toString()
+
+	return (job['name'], out, time.time() - start)
+
 	
 if __name__ == '__main__':
 
@@ -1145,6 +2329,13 @@ if __name__ == '__main__':
 	# pass along cli options to maze
 	def apply_options(maze, options):
 		maze.debug = options.debug	
+		maze.use_fast_grid = not options.no_fast_grid
+		maze.profiler = profiler
+		if options.rules != '':
+			maze.loadRules(options.rules)
+		maze.rewrite_fixpoint = options.fixpoint
+		maze.use_numpy = maze.use_numpy and not options.no_numpy
+		maze.use_char_index = not options.no_char_index
 		maze.thickness = int(options.thickness)
 		maze.length = int(options.length)
 		maze.scan_wall_space = not options.no_wall_scan
@@ -1154,23 +2345,11 @@ if __name__ == '__main__':
 		maze.scan_diagonal = not options.no_zigzag
 
 
-	#  simple template parsing demos / regression tests
-	def demo(options):
+	# demo/regression test templates
+	# returns a list of (template, parser hints)
+	def demo_templates():
 
-		default_parser = mazeify()
-		apply_options(default_parser,options)
-
-		# run through predefined regular shapes
-		if options.test == -1:
-			print("predefined tessellations")
-			types = default_parser.maze_types
-			for maze_type in types: 
-				print("type: " + maze_type)
-				options.maze = maze_type	
-				create_maze(options)
-			print("--")	
-
-		parsers = [] # custom parsing options
+		hints = [] # custom parsing options
 		templates = [] # test templates
 
 
@@ -1218,7 +2397,7 @@ if __name__ == '__main__':
                             \`````|   
 """	
 		templates.append(template)
-		parsers.append(None) # default parser
+		hints.append({}) # default parser
 
 #### test
 
@@ -1264,10 +2443,7 @@ if __name__ == '__main__':
 		templates.append(template)
 
 		# tune parser: explode diagonal walls
-		maze = mazeify()
-		apply_options(maze,options)
-		maze.scan_diagonal = True
-		parsers.append(maze)
+		hints.append({'scan_diagonal': True})
 
 
 #### test 
@@ -1315,12 +2491,11 @@ start   __/  \__/  \__/  \__/  \__/  \__/  \__/  \__
 		templates.append(template)
 
 		# tune parser: set explicit wall length
-		maze = mazeify()
-		apply_options(maze,options)
-		#maze.length = 1
-		maze.use_microspace = True  
-		#maze.dot_last_underscore = True   # sharpen corners _ -> _.
-		parsers.append(maze)
+		hints.append({
+			#'length': 1,
+			'use_microspace': True,
+			#'dot_last_underscore': True,   # sharpen corners _ -> _.
+		})
 
 
 #### test
@@ -1372,31 +2547,53 @@ start   __/  \__/  \__/  \__/  \__/  \__/  \__/  \__
 '''
 
 		templates.append(template)
-		parsers.append(None) # default parser
+		hints.append({}) # default parser
 
 
 #### end test
 
+		return list(zip(templates, hints))
+
+
+	#  simple template parsing demos
+	def demo(options):
+
+		default_parser = mazeify()
+		apply_options(default_parser,options)
+
+		# run through predefined regular shapes
+		if options.test == -1:
+			print("predefined tessellations")
+			types = default_parser.maze_types
+			for maze_type in types: 
+				print("type: " + maze_type)
+				options.maze = maze_type	
+				create_maze(options)
+			print("--")	
+
+		templates = demo_templates()
 
 		# only parse one demo template
 		if options.test > -1:
 			templates = [ templates[options.test] ]	
-			parsers = [ parsers[options.test] ]	
 
 		print("Here's a quick demo using templates") 
 		print("")
 
 
-		for idx,template in enumerate(templates):
-			parser = parsers[idx]
+		for idx,(template,hints) in enumerate(templates):
 
 			print('-' * 79)
 
-			if parser == None:
+			if len(hints) == 0:
 				print("use default parser options")
 				parser = default_parser
 			else: 
 				print("use custom parser options")
+				parser = mazeify()
+				apply_options(parser,options)
+				for k in hints:
+					parser.__dict__[k] = hints[k]
 
 			print("input template ("+str(idx)+"):")
 			print("")
@@ -1408,13 +2605,102 @@ start   __/  \__/  \__/  \__/  \__/  \__/  \__/  \__
 				print(parser.toString(True).rstrip())
 
 			out = parser.toString()
-			parsers[idx] = None # garbage collect
 			print("")
 			print("rendered output:")
 			print("")
 			print(out)
 
 
+	# regression test.  run every demo template and predefined tessellation
+	# under each option variant in a process pool with fixed seeds, and diff
+	# the results against the golden outputs in options.regress.
+	# a missing golden output fails, unless options.update_golden is set.
+	# returns the number of failed jobs.
+	def regress(options):
+
+		variants = [
+			('default', {}),
+			('plain', {'use_numpy': False, 'use_char_index': False, 'use_fast_grid': False}),
+		]
+
+		jobs = []
+		for variant,hints in variants:
+			for maze_type in mazeify().maze_types:
+				jobs.append({ 'name': maze_type+'.'+variant, 'seed': 1,
+					'maze': maze_type, 'template': '', 'width': 10, 'height': 10,
+					'hints': hints })
+
+			for idx,(template,hints2) in enumerate(demo_templates()):
+				hints3 = dict(hints2)
+				hints3.update(hints)
+				jobs.append({ 'name': 'template'+str(idx)+'.'+variant, 'seed': 1,
+					'maze': '', 'template': template, 'width': 0, 'height': 0,
+					'hints': hints3 })
+
+		# rewrite to a fixpoint.  the built-in rules never create matches
+		# for each other, so --fixpoint only changes the result when extra
+		# rules chain: '+_' -> '++' grows corners along underscores, one
+		# cell per pass.
+		chain = [[['+_'], ['++']]]
+		for variant,hints in [('once', {}), ('fixpoint', {'rewrite_fixpoint': True})]:
+			jobs.append({ 'name': 'rules.'+variant, 'seed': 1,
+				'maze': 'hex', 'template': '', 'width': 10, 'height': 10,
+				'hints': dict(hints, rules_pre=chain) })
+
+		# -s on a square maze must leave the fast grid and parse the
+		# template, the same as --no-fast-grid does
+		for (variant,hints) in variants:
+			jobs.append({ 'name': 'square-s.'+variant, 'seed': 3,
+				'maze': 'square', 'template': '', 'width': 4, 'height': 3,
+				'hints': dict(hints, use_microspace=True) })
+
+		if not os.path.isdir(options.regress):
+			os.makedirs(options.regress)
+
+		counts = { 'ok': 0, 'FAIL': 0, 'MISSING': 0, 'new': 0, 'update': 0 }
+		total = 0.0
+		start = time.time()
+
+		workers = options.jobs if options.jobs > 0 else None
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			for (name, out, seconds) in pool.map(run_regression_job, jobs):
+
+				filename = os.path.join(options.regress, name + '.txt')
+				golden = None
+				if os.path.exists(filename):
+					with open(filename, "r") as goldenfile:
+						golden = goldenfile.read()
+
+				if golden == out:
+					status = 'ok'
+				elif options.update_golden:
+					status = 'update' if golden != None else 'new'
+					with open(filename, "w") as goldenfile:
+						goldenfile.write(out)
+				elif golden == None:
+					status = 'MISSING' # see --update-golden
+				else:
+					status = 'FAIL'
+
+				counts[status] += 1
+				total += seconds
+				print(status.ljust(8) + name.ljust(30) + '%8.3fs' % seconds)
+
+				if status == 'FAIL':
+					diff = difflib.unified_diff(golden.split('\n'), out.split('\n'),
+								'golden', 'output', lineterm='', n=1)
+					for line in list(diff)[:40]:
+						print('    ' + line)
+
+		print("")
+		print(', '.join(str(counts[k]) + ' ' + k for k in ['ok','FAIL','MISSING','new','update']))
+		print('job time %.3fs, wall time %.3fs' % (total, time.time() - start))
+		if counts['MISSING'] > 0:
+			print('golden outputs are missing, run with --update-golden to create them')
+
+		return counts['FAIL'] + counts['MISSING']
+
+
 	# parse a template file and display maze
 	def parse_file(options):
 		maze = mazeify()
@@ -1427,37 +2713,30 @@ start   __/  \__/  \__/  \__/  \__/  \__/  \__/  \__
 	# create basis maze
 	def create_maze(options):
 		maze = mazeify()
-		template = maze.tessellate(options.width, options.height, options.maze)
 		apply_options(maze,options)
-
-		# parsing hints
-		hints = { 
-			'block': {
-				'length': 1,
-			},
-			'diamond': {
-				'use_microspace': True,
-			},
-			'hex': {
-				'use_microspace': True,
-			},
-			'micro': {
-				'use_microspace': True,
-			},
-			'triangle': {
-				'use_microspace': True,
-			},
-		}
-		if options.maze in hints:
-			hint = hints[options.maze]
-			for k in hint:
-				if options.debug:
-					print(k, hint[k])
-				maze.__dict__[k] = hint[k]
-
-		maze.parseTemplate(template)
+		maze.createPredefinedMaze(options.maze, options.width, options.height)
 		out = maze.toString()
 		print(out)
+		save_exports(maze, options)
+
+
+	# display a maze exported with --export
+	def load_binary(options):
+		maze = mazeify()
+		with open(options.load, "rb") as binfile:
+			maze.fromBinary(binfile.read())
+		print(maze.toString())
+		save_exports(maze, options)
+
+
+	# save --export and --export-graph files for a finished maze
+	def save_exports(maze, options):
+		if options.export != '':
+			with open(options.export, "wb") as binfile:
+				binfile.write(maze.toBinary(-1 if options.seed == None else options.seed))
+
+		if options.export_graph != '':
+			maze.saveGraph(options.export_graph)
 
 
 	# what maze types are predefined?
@@ -1493,8 +2772,34 @@ start   __/  \__/  \__/  \__/  \__/  \__/  \__/  \__
 
 	parser.add_option('--no-wall-scan', action='store_true', dest='no_wall_scan',
 		help="Don't scan any space that was previously taken by a wall.", default=False)
+	parser.add_option('--no-fast-grid', action='store_true', dest='no_fast_grid',
+		help="Parse square/block/hex/hex2/triangle/diamond mazes from a template, instead of generating them on a cell grid or graph.", default=False)
+	parser.add_option('--no-char-index', action='store_true', dest='no_char_index',
+		help="Don't index unvisited/avoid cell positions (scan the board instead).", default=False)
+	parser.add_option('--no-numpy', action='store_true', dest='no_numpy',
+		help="Don't use numpy to detect the outside of shapes.", default=False)
+	parser.add_option('--rules', action='store', dest='rules',
+		help='Load extra pre/post processing rules from a rule file (for -s).', default='')
+	parser.add_option('--fixpoint', action='store_true', dest='fixpoint',
+		help='Re-apply the pre/post processing rules until nothing changes.', default=False)
 	parser.add_option('--test', action='store', dest='test', type='int',
 		help='Only parse one test template (for regression testing).', default=-1)
+	parser.add_option('--export', action='store', dest='export',
+		help='With -m, also save the maze as packed wall bits to this file (square, block, micro).', default='')
+	parser.add_option('--export-graph', action='store', dest='export_graph',
+		help='With -m or --load, also save the maze rooms and open passages as numpy arrays (.npz).', default='')
+	parser.add_option('--load', action='store', dest='load',
+		help='Display a maze saved with --export.', default='')
+	parser.add_option('--memprofile', action='store_true', dest='memprofile',
+		help='Report peak memory per phase (parseTemplate, walk, toString, ...) on stderr.', default=False)
+	parser.add_option('--seed', action='store', dest='seed', type='int',
+		help='Random seed, for repeatable mazes.', default=None)
+	parser.add_option('--regress', action='store', dest='regress',
+		help='Run all demo templates and maze types in parallel and compare with the golden outputs in this directory.', default='')
+	parser.add_option('--update-golden', action='store_true', dest='update_golden',
+		help='With --regress, write golden outputs that differ or are missing.', default=False)
+	parser.add_option('-j', '--jobs', action='store', dest='jobs', type='int',
+		help='With --regress, number of worker processes (default: one per cpu).', default=0)
 
 	parser.add_option('--dot-last-underscore', action='store_true', dest='dot_last_underscore',
 		help='Add a dot . decorator to last underscore in a segment.', default=False)
@@ -1510,11 +2815,24 @@ start   __/  \__/  \__/  \__/  \__/  \__/  \__/  \__
 
 	options, args = parser.parse_args()
 
-	if options.unittest:
+	if options.seed != None:
+		seed(options.seed)
+
+	profiler = None
+	if options.memprofile:
+		profiler = memprofile()
+
+	if options.regress != '':
+		failed = regress(options)
+		sys.exit(1 if failed > 0 else 0)
+
+	elif options.unittest:
 		maze = mazeify()
 		apply_options(maze,options)
 		maze.unittest()	
 
+	elif options.load != '':
+		load_binary(options)
 	elif options.filename != '':
 		parse_file(options)
 	elif options.maze != '':
@@ -1522,3 +2840,6 @@ start   __/  \__/  \__/  \__/  \__/  \__/  \__/  \__
 	else:
 		demo(options)
 
+	if profiler != None:
+		sys.stderr.write(profiler.toString())
+
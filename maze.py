@@ -3,72 +3,398 @@
 # This draws ASCII mazes (written in Python)
 # Modified from http://rosettacode.org/wiki/Maze_generation
 #
-#     widened cell rendering 
+#     widened cell rendering
 #     tweaked algorithm to produce variable 'curviness'
 #     added optional command line options:
-#    	width    height    difficulty	
+#    	width    height    difficulty    seed
+#
+#     --stream  generate row by row in constant memory (Eller's
+#               algorithm).  height 0 = endless maze.
+#
+#     --batch N     generate N mazes with seeds seed, seed+1, ...
+#     --out DIR     write batch mazes to DIR/maze-<n>.txt (default: stdout)
+#     --jobs N      worker processes for --batch (default: all cpus)
+#     --numpy ALG   generate the whole --batch at once with numpy, where
+#                   ALG is binary-tree, sidewinder or aldous-broder.
+#                   ignores difficulty.
+#
+#               maze.py --batch 10000 10 10 50 1 --out puzzles
+#
+# can also be imported:
+#
+#     from maze import make_maze
+#     for row in make_maze(100, 100, curviness=50, seed=1):
+#         print(row)
 #
 # KS - 2015
 
-from random import shuffle, randrange, randint
+from concurrent.futures import ProcessPoolExecutor
+from random import Random, randrange
+import os
 import sys
 
-# default grid size 
+try:
+	import numpy
+except ImportError:
+	numpy = None # --numpy is not available
+
+# default grid size
 w = 19
-h = 20 
+h = 20
 c = 50  # curvy-ness [0 - 100]
 
-# read grid size from args if available
-if len( sys.argv ) > 2:
-	w = int( sys.argv[ 1 ] )
-	h = int( sys.argv[ 2 ] )
+deltas = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+
+# wall bits, one byte per cell
+WEST = 1
+NORTH = 2
 
-if len( sys.argv ) > 3:
-	c = int( sys.argv[ 3 ] )
+# walk state bits, one byte per cell:
+#   0-1  rotation of deltas when the cell was reached
+#   2-4  next delta to try (4 = done)
+#   5-6  delta that led into the cell (to back up without a stack)
+#   7    visited
+VISITED = 128
 
-deltas = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+# generate a w x h maze, yields the rows of ASCII output.
+# curviness [0 - 100] is the chance of turning the preferred direction
+# at each cell.  seed makes the maze repeatable.
+def make_maze(w, h, curviness=50, seed=None):
+
+	rng = Random(seed)
+	walls = bytearray([WEST | NORTH]) * (w * h)
+	trail = bytearray(w * h)
+
+	# iterative depth first walk.  same visit order as the classic
+	# recursive walk, but the path back is kept in trail[]
+	x = rng.randrange(w)
+	y = rng.randrange(h)
+	start = i = y * w + x
+	rot = 0
+
+	if rng.randint(0, 100) < curviness:
+		rot = (rot + 1) % 4 # prefer same delta?
+	trail[i] = VISITED | rot
+
+	while True:
+		t = trail[i]
+		n = (t >> 2) & 7
+
+		if n == 4:
+			# all paths tried, back up
+			if i == start:
+				break
+			(dx, dy) = deltas[(t >> 5) & 3]
+			i -= dy * w + dx
+			continue
+
+		trail[i] = t + 4
+		d = (n + (t & 3)) % 4
+		(dx, dy) = deltas[d]
+		(x, y) = (i % w + dx, i // w + dy)
+		if x < 0 or x >= w or y < 0 or y >= h:
+			continue
+
+		i2 = y * w + x
+		if trail[i2]:
+			continue
+
+		# knock down wall
+		if dy == 0:
+			walls[max(i, i2)] &= ~WEST
+		else:
+			walls[max(i, i2)] &= ~NORTH
+
+		if rng.randint(0, 100) < curviness:
+			rot = (rot + 1) % 4
+		trail[i2] = VISITED | (d << 5) | rot
+		i = i2
+
+	del trail
+
+	for row in render_maze(walls, w, h):
+		yield row
+
+
+# draw w x h wall bits (WEST, NORTH per cell, row major), yields the
+# rows of ASCII output
+def render_maze(walls, w, h):
+
+	for y in range(h):
+		hor = ['+---' if walls[y * w + x] & NORTH else '+   ' for x in range(w)]
+		if y == 0:
+			hor[w - 1] = '+   ' # punch hole
+		yield ''.join(hor) + '+'
+		yield ''.join('|   ' if walls[y * w + x] & WEST else '    ' for x in range(w)) + '|'
+
+	yield '+   ' + '+---' * (w - 1) + '+' # punch hole
+
+
+# stream a w x h maze row by row with Eller's algorithm, yields the rows
+# of ASCII output as soon as they are decided.  only the current row is
+# kept, so memory is O(w).  h = 0 streams forever.
+# curviness [0 - 100] shortens the horizontal runs and adds extra drops
+# to the next row; 0 gives long straight corridors.
+def stream_maze(w, h=0, curviness=50, seed=None):
+
+	rng = Random(seed)
+	join = 1 - curviness / 200.0 # chance to join cell to the right
+	drop = curviness / 200.0 # chance of an extra path down from a set
+
+	yield '+---' * (w - 1) + '+   +' # punch hole
+
+	sets = [-1] * w # set id of each cell in this row, -1 = new cell
+	parent = [] # joined sets, reset every row
+
+	def find(s):
+		while parent[s] != s:
+			parent[s] = parent[parent[s]]
+			s = parent[s]
+		return s
+
+	y = 0
+	while h == 0 or y < h:
+		last = (y == h - 1)
+
+		# give new cells their own set
+		free = iter(sorted(set(range(w)) - set(sets)))
+		sets = [s if s >= 0 else next(free) for s in sets]
+
+		# join cells to the right
+		parent[:] = range(w)
+		east = [False] * w # open east walls
+		for x in range(w - 1):
+			(a, b) = (find(sets[x]), find(sets[x + 1]))
+			if a != b and (last or rng.random() < join):
+				parent[b] = a
+				east[x] = True
+		sets = [find(s) for s in sets]
+
+		yield '|' + ''.join('    ' if east[x] else '   |' for x in range(w - 1)) + '   |'
+
+		if last:
+			break
+
+		# at least one path down from each set
+		groups = {}
+		for x in range(w):
+			groups.setdefault(sets[x], []).append(x)
+
+		down = [False] * w # open south walls
+		for s in sorted(groups):
+			xs = groups[s]
+			down[xs[rng.randrange(len(xs))]] = True
+			for x in xs:
+				if rng.random() < drop:
+					down[x] = True
+
+		yield '+' + ''.join('   +' if down[x] else '---+' for x in range(w))
+
+		sets = [sets[x] if down[x] else -1 for x in range(w)]
+		y += 1
+
+	yield '+   ' + '+---' * (w - 1) + '+' # punch hole
+
+
+# generate count w x h mazes at once with numpy, one array op per step
+# for the whole batch.  returns wall bits as a (count, h, w) uint8 array
+# (see render_maze).  algorithm is one of numpy_algorithms:
+#
+#   binary-tree     each cell opens north or west.  fastest, long open
+#                   top row and left column.
+#   sidewinder      rows of east runs, each run opens north once.
+#   aldous-broder   random walks in lockstep until every cell is
+#                   visited.  unbiased (uniform spanning tree), slowest.
+#
+# maze n uses seed + n, and its random numbers don't depend on the rest
+# of the batch: it is the same maze as numpy_mazes(1, w, h, algorithm,
+# seed + n).
+numpy_algorithms = ['binary-tree', 'sidewinder', 'aldous-broder']
+
+def numpy_mazes(count, w, h, algorithm='sidewinder', seed=None):
+
+	if numpy == None:
+		raise Exception('numpy is required for numpy_mazes()')
+	if not algorithm in numpy_algorithms:
+		raise Exception('unknown algorithm: ' + str(algorithm))
+
+	if seed == None:
+		seed = randrange(2**31)
+	seeds = numpy.arange(count, dtype=numpy.uint64) + numpy.uint64(seed % 2**64)
+	cells = numpy.arange(w * h, dtype=numpy.uint64).reshape((h, w))
+	walls = numpy.full((count, h, w), WEST | NORTH, dtype=numpy.uint8)
+
+	if algorithm == 'binary-tree':
+		north = numpy_random(seeds[:, None, None], cells) < 0.5
+		north[:, :, 0] = True # left column can only go north
+		north[:, 0, :] = False # top row can only go west
+		west = ~north
+		west[:, :, 0] = False
+		walls[north] &= 255 ^ NORTH
+		walls[west] &= 255 ^ WEST
+
+	elif algorithm == 'sidewinder':
+		# top row is one run, the other rows are independent
+		walls[:, 0, 1:] &= 255 ^ WEST
+		east = numpy_random(seeds[:, None, None], cells) < 0.5
+		east[:, :, w - 1] = False
+		pick = numpy_random(seeds[:, None, None], cells + numpy.uint64(w * h))
+
+		start = numpy.zeros((count, h), dtype=numpy.intp)
+		(k, y) = numpy.indices((count, h))
+		for x in range(w):
+			# close runs that end here, open north from a random cell
+			end = ~east[:, :, x]
+			end[:, 0] = False
+			x2 = start + (pick[:, :, x] * (x - start + 1)).astype(numpy.intp)
+			walls[k[end], y[end], x2[end]] &= 255 ^ NORTH
+			start[end] = x + 1
+			if x < w - 1:
+				walls[:, :, x + 1][east[:, :, x]] &= 255 ^ WEST
+
+	else:
+		# aldous-broder, one walker per maze
+		walls = walls.reshape((count, w * h))
+		visited = numpy.zeros((count, w * h), dtype=bool)
+		pos = (numpy_random(seeds, 0) * (w * h)).astype(numpy.intp)
+		visited[numpy.arange(count), pos] = True
+		left = numpy.full(count, w * h - 1) # unvisited cells per maze
+		active = numpy.flatnonzero(left > 0)
+		step = 0 # every walker takes a step each round
+
+		while len(active) > 0:
+			step += 1
+			p = pos[active]
+			(x, y) = (p % w, p // w)
+			d = (numpy_random(seeds[active], step) * 4).astype(numpy.intp)
+			dx = numpy.array([-1, 1, 0, 0])[d]
+			dy = numpy.array([0, 0, 1, -1])[d]
+			ok = (x + dx >= 0) & (x + dx < w) & (y + dy >= 0) & (y + dy < h)
+
+			(active, p, dx, dy) = (active[ok], p[ok], dx[ok], dy[ok])
+			p2 = p + dy * w + dx
+
+			# knock down walls into unvisited cells
+			new = ~visited[active, p2]
+			(k, c1, c2) = (active[new], numpy.maximum(p, p2)[new], dx[new] != 0)
+			walls[k[c2], c1[c2]] &= 255 ^ WEST
+			walls[k[~c2], c1[~c2]] &= 255 ^ NORTH
+			visited[k, p2[new]] = True
+			left[k] -= 1
+
+			pos[active] = p2
+			active = numpy.flatnonzero(left > 0)
+
+		walls = walls.reshape((count, h, w))
+
+	return walls
+
+
+# counter based random numbers in [0, 1) for numpy_mazes(): number
+# counter of the SplitMix64 stream of each seed.  seeds and counters are
+# broadcast uint64 arrays (or ints), so every maze draws from its own
+# stream in one array op.
+def numpy_random(seeds, counters):
+	with numpy.errstate(over='ignore'):
+		x = seeds + (numpy.asarray(counters, dtype=numpy.uint64) + numpy.uint64(1)) * numpy.uint64(0x9E3779B97F4A7C15)
+		x = (x ^ (x >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+		x = (x ^ (x >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+		x = x ^ (x >> numpy.uint64(31))
+	return (x >> numpy.uint64(11)).astype(numpy.float64) * (1.0 / 2**53)
+
+
+# one maze of a batch, as text.  job is (n, w, h, curviness, seed)
+def batch_maze(job):
+	(n, w, h, curviness, seed) = job
+	head = '# maze %d seed %d size %dx%d curviness %d' % (n, seed, w, h, curviness)
+	return '\n'.join([head] + list(make_maze(w, h, curviness, seed))) + '\n'
+
+
+# generate count w x h mazes with seeds seed, seed+1, ... on a pool of
+# worker processes.  yields (n, seed, text) in order.
+def make_batch(count, w, h, curviness=50, seed=0, jobs=None):
+
+	batch = [(n, w, h, curviness, seed + n) for n in range(count)]
+	chunk = max(1, count // (4 * (jobs or os.cpu_count() or 1)))
+
+	with ProcessPoolExecutor(max_workers=jobs) as pool:
+		for (job, text) in zip(batch, pool.map(batch_maze, batch, chunksize=chunk)):
+			yield (job[0], job[4], text)
+
+
+# like make_batch, but generates the whole batch with numpy_mazes().
+# maze n uses seed + n, as in make_batch.
+def make_numpy_batch(count, w, h, algorithm='sidewinder', seed=0):
 
-def shift(l, n):
-	return l[n:] + l[:n]
+	walls = numpy_mazes(count, w, h, algorithm, seed)
+	for n in range(count):
+		head = '# maze %d seed %d size %dx%d algorithm %s' % (n, seed + n, w, h, algorithm)
+		text = '\n'.join([head] + list(render_maze(walls[n].tobytes(), w, h))) + '\n'
+		yield (n, seed + n, text)
 
-# get adjacent cells
-def get_paths (x, y):
-	global deltas, c
-	d = []
 
-	# prefer same delta?
-	if randint( 0, 100 ) < c:
-		deltas = shift(deltas,1)
+# pop a "--name value" option off the command line
+def pop_option(name, default=None):
+	if not name in sys.argv:
+		return default
+	i = sys.argv.index(name)
+	value = sys.argv[i + 1]
+	del sys.argv[i:i + 2]
+	return value
 
-	for (dx, dy) in deltas:
-		d.append( (x + dx, y + dy) )
 
-	return d
- 
-def make_maze(w, h):
+if __name__ == '__main__':
 
-	vis = [[0] * w + [1] for _ in range(h)] + [[1] * (w + 1)]
-	ver = [["|   "] * w + ['|'] for _ in range(h)] + [[]]
-	hor = [["+---"] * w + ['+'] for _ in range(h + 1)]
+	seed = None
 
-	def walk(x, y, d_old=[]):
-		vis[y][x] = 1
-		d = get_paths(x,y)
-		
-		for (xx, yy) in d:
-			if vis[yy][xx]: continue
-			if xx == x: hor[max(y, yy)][x] = "+   "
-			if yy == y: ver[y][max(x, xx)] = "    "
-			walk(xx, yy, d)
+	# stream row by row (see stream_maze), height 0 = forever
+	stream = '--stream' in sys.argv
+	if stream:
+		sys.argv.remove('--stream')
 
-	walk(randrange(w), randrange(h))
+	# batch of mazes (see make_batch)
+	count = int(pop_option('--batch', 0))
+	out = pop_option('--out')
+	jobs = pop_option('--jobs')
+	jobs = int(jobs) if jobs else None
+	algorithm = pop_option('--numpy')
 
-	# punch holes
-	hor[0][w-1] = '+   '
-	hor[h][0] = '+   '
+	# read grid size from args if available
+	if len( sys.argv ) > 2:
+		w = int( sys.argv[ 1 ] )
+		h = int( sys.argv[ 2 ] )
 
-	for (a, b) in zip(hor, ver):
-		print(''.join(a + ['\n'] + b))
+	if len( sys.argv ) > 3:
+		c = int( sys.argv[ 3 ] )
 
-make_maze(w,h)
+	if len( sys.argv ) > 4:
+		seed = int( sys.argv[ 4 ] )
 
+	if count > 0:
+		if seed == None:
+			seed = randrange(2**31) # pick a base seed, printed with each maze
+		if out and not os.path.isdir(out):
+			os.makedirs(out)
+		digits = len(str(count - 1))
+		if algorithm:
+			batch = make_numpy_batch(count, w, h, algorithm, seed)
+		else:
+			batch = make_batch(count, w, h, c, seed, jobs)
+		for (n, seed2, text) in batch:
+			if out:
+				with open(os.path.join(out, 'maze-%0*d.txt' % (digits, n)), 'w') as f:
+					f.write(text)
+			else:
+				print(text) # blank line between mazes
+	elif stream:
+		try:
+			for row in stream_maze(w, h, c, seed):
+				print(row)
+				sys.stdout.flush()
+			print('')
+		except (KeyboardInterrupt, IOError):
+			sys.stdout = None # stopped, or output pipe closed
+	else:
+		for row in make_maze(w, h, c, seed):
+			print(row)
+		print('')